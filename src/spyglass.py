@@ -21,6 +21,7 @@
 import sys
 import os
 import logging
+import multiprocessing
 import traceback
 
 from logging.handlers import RotatingFileHandler
@@ -212,5 +213,7 @@ class Application(QApplication):
 
 # The main application
 if __name__ == "__main__":
+    # the annotation workers of a rescan start from this module in a frozen build
+    multiprocessing.freeze_support()
     app = Application(sys.argv)
     sys.exit(app.exec())
@@ -1,18 +1,19 @@
+"""Appends a message to a chat log, the way the EVE client does.
+
+    python tools/addmessage.py PATH_TO_LOG "the message" [user]
+"""
+
 import sys
 
-PATH = "/home/sparrow/EVE/logs/Chatlogs/TheCitadel_20401229_065150.txt"
+from genchatlogs import appendLine
 
 
 def main():
-    line = ""
-    with open(PATH, "r", encoding="utf-16") as f:
-        content = f.read()
-        lines = content.split("\n")
-        line = lines[-2].strip()
-        line = line[: line.find(">") + 1]
-    line = line + " " + sys.argv[1] + "\n"
-    with open(PATH, "a") as f:
-        f.write(line.encode("utf-16"))
+    if len(sys.argv) < 3:
+        print(__doc__, file=sys.stderr)
+        sys.exit(1)
+    user = sys.argv[3] if len(sys.argv) > 3 else "Spyglass Tester"
+    appendLine(sys.argv[1], user, sys.argv[2])
 
 
 if __name__ == "__main__":
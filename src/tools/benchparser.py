@@ -0,0 +1,302 @@
+###########################################################################
+#  benchparser - Throughput benchmark of the chat parser                 #
+#  Copyright (C) 2017 Crypta Eve (crypta@crypta.tech)                     #
+# 																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+# 																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+# 																		  #
+# 																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+"""
+Replays a directory of EVE chat logs through the parser without the GUI and
+reports the throughput of every stage as JSON:
+
+    decode     utf-16-le decoding of the appended bytes
+    timestamp  parsing the line timestamps
+    annotate   finding ships, urls and systems and rendering the html
+    status     reading the status from the annotated tokens
+    parser     ChatParser.fileModified for every appended line, end to end
+
+Every stage reports lines per second, the p50/p99 latency per line and the
+peak RSS of the process after the stage. The stages run one after another
+in this order, so the peak RSS only grows. The numbers are rounded and the
+keys sorted, so the output of two commits can be compared with diff.
+
+Run it from the src directory:
+
+    python tools/benchparser.py ~/Documents/EVE/logs/Chatlogs --output bench.json
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import codecs
+import logging
+import argparse
+import tempfile
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vi import dotlan
+from vi.cache import cache
+from vi.chatlogdirectory import parseLogName
+from vi.chatparser.chatparser import ChatParser, LogTimestamps, LOCAL_NAMES
+from vi.chatparser.chatparser import HEADER_LINES
+from vi.chatparser.parser_functions import SystemNameIndex, tokenizeLine
+from vi.chatparser.parser_functions import renderTokens, parseStatus
+
+DEFAULT_MAP = os.path.join("vi", "ui", "res", "mapdata", "Providencecatch.svg")
+
+
+def errout(*objs):
+    print(*objs, file=sys.stderr)
+
+
+def peakRss():
+    """Returns the peak resident set size of the process in KB, None if unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux KB
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def stageResult(latencies, seconds):
+    """Returns the figures of a stage from the per line latencies in ns"""
+    latencies = sorted(latencies)
+    count = len(latencies)
+
+    def percentile(p):
+        if not count:
+            return 0.0
+        return round(latencies[min(count - 1, int(count * p))] / 1000.0, 2)
+
+    return {
+        "lines": count,
+        "linesPerSec": round(count / seconds) if seconds else 0,
+        "p50Us": percentile(0.50),
+        "p99Us": percentile(0.99),
+        "peakRssKb": peakRss(),
+    }
+
+
+def readLogs(path):
+    """Returns {filename: lines} of the chat logs in path, the lines are decoded
+    with the header included
+    """
+    logs = {}
+    for filename in sorted(os.listdir(path)):
+        if parseLogName(filename) is None:
+            continue
+        with open(os.path.join(path, filename), "rb") as f:
+            content = f.read().decode("utf-16-le", errors="replace")
+        logs[filename] = content.split("\n")[:-1]
+    return logs
+
+
+def roomName(filename):
+    return parseLogName(filename).room
+
+
+def lineText(line):
+    return line[line.find(">") + 1 :].strip()
+
+
+def lineTimeStr(line):
+    return line[line.find("[") + 1 : line.find("]")].strip()
+
+
+def benchDecode(logs):
+    latencies = []
+    started = time.perf_counter()
+    for lines in logs.values():
+        decoder = codecs.getincrementaldecoder("utf-16-le")()
+        body = lines[HEADER_LINES:]
+        for data in [(line + "\n").encode("utf-16-le") for line in body]:
+            start = time.perf_counter_ns()
+            decoder.decode(data)
+            latencies.append(time.perf_counter_ns() - start)
+    return stageResult(latencies, time.perf_counter() - started)
+
+
+def benchTimestamps(logs):
+    """Returns the stage result and the epochs of all body lines in order"""
+    latencies = []
+    epochs = {}
+    started = time.perf_counter()
+    for filename, lines in logs.items():
+        timestamps = LogTimestamps()
+        fileEpochs = epochs[filename] = []
+        for line in lines[HEADER_LINES:]:
+            timeStr = lineTimeStr(line)
+            start = time.perf_counter_ns()
+            try:
+                epoch = timestamps.parse(timeStr)[1]
+            except ValueError:
+                epoch = None
+            latencies.append(time.perf_counter_ns() - start)
+            fileEpochs.append(epoch)
+    return stageResult(latencies, time.perf_counter() - started), epochs
+
+
+def benchAnnotate(logs, systems):
+    """Returns the stage result and the tokens of all intel lines"""
+    systemIndex = SystemNameIndex(systems.keys())
+    latencies = []
+    tokenLists = []
+    started = time.perf_counter()
+    for filename, lines in logs.items():
+        if roomName(filename) in LOCAL_NAMES:
+            continue
+        for line in lines[HEADER_LINES:]:
+            text = lineText(line)
+            start = time.perf_counter_ns()
+            tokens = tokenizeLine(text, systems, systemIndex, set())
+            renderTokens(tokens)
+            latencies.append(time.perf_counter_ns() - start)
+            tokenLists.append(tokens)
+    return stageResult(latencies, time.perf_counter() - started), tokenLists
+
+
+def benchStatus(tokenLists):
+    latencies = []
+    started = time.perf_counter()
+    for tokens in tokenLists:
+        start = time.perf_counter_ns()
+        parseStatus(tokens)
+        latencies.append(time.perf_counter_ns() - start)
+    return stageResult(latencies, time.perf_counter() - started)
+
+
+def benchParser(logs, epochs, systems, speed, intelTime):
+    """Appends the lines of all logs in timestamp order to copies in a temporary
+    directory and lets a ChatParser parse every appended line. With a speed
+    the lines are appended at that multiple of the time between their timestamps,
+    else as fast as possible.
+    """
+    replay = []
+    for filename, lines in logs.items():
+        lastEpoch = None
+        for line, epoch in zip(lines[HEADER_LINES:], epochs[filename]):
+            lastEpoch = epoch if epoch is not None else lastEpoch
+            replay.append((lastEpoch or 0, filename, line))
+    replay.sort(key=lambda entry: entry[0])
+    rooms = [roomName(f) for f in logs if roomName(f) not in LOCAL_NAMES]
+    latencies = []
+    with tempfile.TemporaryDirectory() as path:
+        parser = ChatParser(path, rooms, systems, intelTime, errout)
+        handles = {}
+        for filename, lines in logs.items():
+            handle = open(os.path.join(path, filename), "ab")
+            header = "".join(line + "\n" for line in lines[:HEADER_LINES])
+            handle.write(header.encode("utf-16-le"))
+            handle.flush()
+            handles[filename] = handle
+        firstEpoch = replay[0][0] if replay else 0
+        started = time.perf_counter()
+        for epoch, filename, line in replay:
+            if speed:
+                due = started + (epoch - firstEpoch) / speed
+                if due > time.perf_counter():
+                    time.sleep(due - time.perf_counter())
+            handle = handles[filename]
+            handle.write((line + "\n").encode("utf-16-le"))
+            handle.flush()
+            start = time.perf_counter_ns()
+            parser.fileModified(handle.name)
+            latencies.append(time.perf_counter_ns() - start)
+        seconds = time.perf_counter() - started
+        parser.close()
+        for handle in handles.values():
+            handle.close()
+    return stageResult(latencies, seconds)
+
+
+def main():
+    argParser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    argParser.add_argument("logs", help="directory with the chat logs to replay")
+    argParser.add_argument(
+        "--map", default=DEFAULT_MAP, help="svg of the region to resolve systems on"
+    )
+    argParser.add_argument(
+        "--speed",
+        type=float,
+        default=0,
+        help="replay at this multiple of real time, 0 is as fast as possible",
+    )
+    argParser.add_argument(
+        "--intel-time",
+        type=int,
+        default=None,
+        help="intel time of the parser in minutes, default covers all lines",
+    )
+    argParser.add_argument("--output", help="write the JSON here, not to stdout")
+    args = argParser.parse_args()
+    if not os.path.isdir(args.logs):
+        errout("ERROR: {0} is no directory!".format(args.logs))
+        sys.exit(2)
+    logging.basicConfig(level=logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as cacheDir:
+        cache.Cache.PATH_TO_CACHE = os.path.join(cacheDir, "cache.sqlite3")
+        with open(args.map) as f:
+            region = os.path.splitext(os.path.basename(args.map))[0]
+            systems = dotlan.Map(region, svgFile=f.read()).systems
+
+        logs = readLogs(args.logs)
+        decode = benchDecode(logs)
+        timestamp, epochs = benchTimestamps(logs)
+        annotate, tokenLists = benchAnnotate(logs, systems)
+        status = benchStatus(tokenLists)
+        intelTime = args.intel_time
+        if intelTime is None:
+            known = [e for fileEpochs in epochs.values() for e in fileEpochs if e]
+            oldest = min(known) if known else time.time()
+            intelTime = int((time.time() - oldest) / 60) + 1
+        parser = benchParser(logs, epochs, systems, args.speed, intelTime)
+        cache.Cache.flushWrites()
+
+    result = {
+        "input": {
+            "files": len(logs),
+            "lines": sum(max(0, len(l) - HEADER_LINES) for l in logs.values()),
+            "map": region,
+            "systems": len(systems),
+            "speed": args.speed,
+        },
+        "stages": {
+            "decode": decode,
+            "timestamp": timestamp,
+            "annotate": annotate,
+            "status": status,
+            "parser": parser,
+        },
+    }
+    output = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+###########################################################################
+#  genchatlogs - Writes synthetic EVE chat logs for load testing         #
+#  Copyright (C) 2017 Crypta Eve (crypta@crypta.tech)                     #
+# 																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+# 																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+# 																		  #
+# 																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+"""
+Writes chat logs like the EVE client does, to soak test the file watcher and
+the parser without a client. Intel channels and Local files get the log header
+of the client and then lines at the given rate, until the duration is over or
+the tool is stopped. Systems come from a region map, ships from evegate.
+
+Run it from the src directory and point Spyglass to the same directory:
+
+    python tools/genchatlogs.py /tmp/Chatlogs --channels 8 --locals 4 --rate 20
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import random
+import datetime
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vi import dotlan, evegate
+from vi.cache import cache
+
+DEFAULT_MAP = os.path.join("vi", "ui", "res", "mapdata", "Providencecatch.svg")
+HEADER_RULE = "        " + "-" * 63
+EVE_TIME_FORMAT = "%Y.%m.%d %H:%M:%S"
+
+FIRST_NAMES = ("Alt", "Bo", "Cyn", "Dax", "Eve", "Fyr", "Gor", "Hal", "Iko", "Jin")
+LAST_NAMES = ("Ashford", "Blackrock", "Crane", "Drake", "Ember", "Frost", "Gale")
+
+# the lines of intel channels, one of the formats is picked at random
+REPORT_FORMATS = (
+    "{system} {ship} +{count}",
+    "{system} {count}x {ship} nv",
+    "{pilot} {system} {ship}",
+    "{system} gate {ship} camp",
+    "{system} red +{count}",
+)
+CLEAR_FORMATS = ("{system} clr", "{system} clear", "clr", "blue")
+REQUEST_FORMATS = ("{system} status?", "status {system}", "{system}?", "stat")
+
+
+def errout(*objs):
+    print(*objs, file=sys.stderr)
+
+
+def eveTime():
+    return datetime.datetime.utcnow()
+
+
+def logHeader(channelName, listener, sessionStart, channelId="-1"):
+    """Returns the 12 header lines the EVE client starts every log with"""
+    lines = [
+        "\ufeff",
+        "",
+        HEADER_RULE,
+        "",
+        "          Channel ID:      {0}".format(channelId),
+        "          Channel Name:    {0}".format(channelName),
+        "          Listener:        {0}".format(listener),
+        "          Session started: {0}".format(sessionStart.strftime(EVE_TIME_FORMAT)),
+        HEADER_RULE,
+        "",
+        "",
+        "",
+    ]
+    return "".join(line + "\r\n" for line in lines)
+
+
+def formatLine(user, text, timestamp=None):
+    timestamp = timestamp or eveTime()
+    return "[ {0} ] {1} > {2}\r\n".format(
+        timestamp.strftime(EVE_TIME_FORMAT), user, text
+    )
+
+
+def appendLine(path, user, text, timestamp=None):
+    with open(path, "ab") as f:
+        f.write(formatLine(user, text, timestamp).encode("utf-16-le"))
+
+
+def createLog(directory, room, listener, charId, sessionStart, channelId="-1"):
+    """Creates the log of a new session and returns its path"""
+    filename = "{0}_{1}_{2}.txt".format(
+        room, sessionStart.strftime("%Y%m%d_%H%M%S"), charId
+    )
+    path = os.path.join(directory, filename)
+    with open(path, "wb") as f:
+        header = logHeader(room, listener, sessionStart, channelId)
+        f.write(header.encode("utf-16-le"))
+    return path
+
+
+def loadSystemNames(svgPath):
+    with tempfile.TemporaryDirectory() as cacheDir:
+        cache.Cache.PATH_TO_CACHE = os.path.join(cacheDir, "cache.sqlite3")
+        with open(svgPath) as f:
+            region = os.path.splitext(os.path.basename(svgPath))[0]
+            systems = sorted(dotlan.Map(region, svgFile=f.read()).systems.keys())
+        cache.Cache.flushWrites()
+        return systems
+
+
+class IntelGenerator(object):
+    """Makes up the lines of the channels, every line is a report, a clear or a
+    status request of one of the pilots
+    """
+
+    def __init__(self, systems, pilots, clearRatio, requestRatio, rnd):
+        self.systems = systems
+        self.ships = [ship.title() for ship in evegate.SHIPNAMES]
+        self.pilots = [
+            "{0} {1} {2}".format(rnd.choice(FIRST_NAMES), rnd.choice(LAST_NAMES), i)
+            for i in range(pilots)
+        ]
+        self.clearRatio = clearRatio
+        self.requestRatio = requestRatio
+        self.rnd = rnd
+
+    def intelLine(self):
+        """Returns (user, text) of the next intel line"""
+        roll = self.rnd.random()
+        if roll < self.clearRatio:
+            formats = CLEAR_FORMATS
+        elif roll < self.clearRatio + self.requestRatio:
+            formats = REQUEST_FORMATS
+        else:
+            formats = REPORT_FORMATS
+        text = self.rnd.choice(formats).format(
+            system=self.rnd.choice(self.systems),
+            ship=self.rnd.choice(self.ships),
+            pilot=self.rnd.choice(self.pilots),
+            count=self.rnd.randint(1, 40),
+        )
+        return self.rnd.choice(self.pilots), text
+
+    def localLine(self):
+        """Returns (user, text) of a jump of the listener"""
+        system = self.rnd.choice(self.systems)
+        return "EVE System", "Channel changed to Local : {0}*".format(system)
+
+
+def main():
+    argParser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    argParser.add_argument("directory", help="the directory to write the logs to")
+    argParser.add_argument(
+        "--map", default=DEFAULT_MAP, help="svg of the region the systems are from"
+    )
+    argParser.add_argument("--channels", type=int, default=8, help="intel channels")
+    argParser.add_argument("--locals", type=int, default=4, help="Local logs")
+    argParser.add_argument("--pilots", type=int, default=200, help="pilots posting")
+    argParser.add_argument(
+        "--rate", type=float, default=10.0, help="lines per second, all logs together"
+    )
+    argParser.add_argument(
+        "--local-share", type=float, default=0.1, help="part of the lines in Local"
+    )
+    argParser.add_argument(
+        "--clear-ratio", type=float, default=0.2, help="part of the intel that clears"
+    )
+    argParser.add_argument(
+        "--request-ratio",
+        type=float,
+        default=0.1,
+        help="part of the intel that asks for a status",
+    )
+    argParser.add_argument(
+        "--duration", type=float, default=0, help="seconds to run, 0 runs until killed"
+    )
+    argParser.add_argument("--seed", type=int, default=None, help="random seed")
+    args = argParser.parse_args()
+    if args.rate <= 0 or args.channels < 1:
+        errout("ERROR: need a rate above 0 and at least one channel")
+        sys.exit(1)
+    os.makedirs(args.directory, exist_ok=True)
+
+    rnd = random.Random(args.seed)
+    generator = IntelGenerator(
+        loadSystemNames(args.map),
+        args.pilots,
+        args.clear_ratio,
+        args.request_ratio,
+        rnd,
+    )
+    sessionStart = eveTime()
+    listeners = rnd.sample(generator.pilots, max(args.locals, 1))
+    channels = [
+        createLog(
+            args.directory,
+            "Intel{0}".format(i + 1),
+            listeners[0],
+            90000000,
+            sessionStart,
+        )
+        for i in range(args.channels)
+    ]
+    locals_ = [
+        createLog(
+            args.directory, "Local", listener, 90000001 + i, sessionStart, "local"
+        )
+        for i, listener in enumerate(listeners[: args.locals])
+    ]
+    errout("Writing {0} lines per second to {1}".format(args.rate, args.directory))
+
+    started = time.time()
+    written = 0
+    try:
+        while not args.duration or time.time() - started < args.duration:
+            if locals_ and rnd.random() < args.local_share:
+                path = rnd.choice(locals_)
+                user, text = generator.localLine()
+            else:
+                path = rnd.choice(channels)
+                user, text = generator.intelLine()
+            appendLine(path, user, text)
+            written += 1
+            # keep the average rate, even if writing fell behind for a moment
+            delay = started + written / args.rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+    except KeyboardInterrupt:
+        pass
+    errout("Wrote {0} lines in {1:.0f} seconds".format(written, time.time() - started))
+
+
+if __name__ == "__main__":
+    main()
@@ -17,8 +17,12 @@
 #  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
 ###########################################################################
 
+import sys
 import sqlite3
 import threading
+import collections
+import queue
+import atexit
 import time
 import logging
 import vi.version
@@ -33,6 +37,181 @@ def from_blob(x):
     return x
 
 
+# Writes are collected this many seconds and then committed together
+WRITE_FLUSH_INTERVAL = 0.5
+# How long a flush waits for the writer before it gives up
+WRITE_FLUSH_TIMEOUT = 10
+
+# Marks a pending write that deletes its row
+DELETED = object()
+
+# Keys per query of getMany, below the variable limit of older SQLite builds
+MANY_CHUNK = 500
+
+# Memory the rows of the front cache may take, with their decoded objects
+FRONT_CACHE_BYTES = 16 * 1024 * 1024
+# Marks a front cache entry whose value was not decoded yet
+NOT_DECODED = object()
+
+
+class FrontCache(object):
+    """Bounded LRU cache of the rows of the cache table, in front of SQLite. An
+    entry keeps the row (key, data, modified, maxAge) and the value decoded from
+    data, so hot keys are neither queried nor decoded again. An entry lives until
+    the row is outdated, or until the memory budget pushes it out.
+    """
+
+    def __init__(self, maxBytes=FRONT_CACHE_BYTES):
+        self.maxBytes = maxBytes
+        self.entries = collections.OrderedDict()  # (path, key): [row, decoded, size]
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, key):
+        """Returns the entry of key, None if it is unknown or outdated"""
+        with self.lock:
+            entry = self.entries.get((path, key))
+            if entry is not None and entry[0][2] + entry[0][3] < time.time():
+                self._remove((path, key))
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end((path, key))
+            self.hits += 1
+            return entry
+
+    def put(self, path, row, decoded=NOT_DECODED):
+        """Keeps row, it replaces the entry of its key"""
+        size = sys.getsizeof(row[1])
+        with self.lock:
+            self._remove((path, row[0]))
+            # a value bigger than an eighth of the budget once decoded would push
+            # out the rest, decoded entries count double
+            if size * 2 > self.maxBytes // 8:
+                return
+            entry = [row, NOT_DECODED, size]
+            self.entries[(path, row[0])] = entry
+            self.size += size
+            self._setDecoded(entry, decoded)
+
+    def setDecoded(self, path, key, decoded):
+        """Keeps the decoded value of the entry of key, if it is still there"""
+        with self.lock:
+            entry = self.entries.get((path, key))
+            if entry is not None:
+                self._setDecoded(entry, decoded)
+
+    def _setDecoded(self, entry, decoded):
+        if entry[1] is NOT_DECODED and decoded is not NOT_DECODED:
+            # the size of an object tree is not known, guess it from the raw data
+            entry[1] = decoded
+            entry[2] *= 2
+            self.size += entry[2] // 2
+        while self.size > self.maxBytes and self.entries:
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class CacheWriter(threading.Thread):
+    """The single thread all writes to the cache go through. Writes are collected
+    for WRITE_FLUSH_INTERVAL and committed as one transaction. Until then, the
+    values of the key/value tables are kept in pending, so reads see them at once.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self, name="CacheWriter", daemon=True)
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = {}  # (path, table, key): (value, write)
+
+    def write(self, path, statements, table=None, values=None):
+        """Queues statements, a list of (query, parameters), to run on the cache at
+        path. Parameters given as a list of tuples run the query with executemany.
+        values is a dict {key: value} of what reads of the keys of table see until
+        the write is committed.
+        """
+        write = (path, statements, table, values or {})
+        with self.lock:
+            if not self.is_alive():
+                self.start()
+            for key, value in write[3].items():
+                self.pending[(path, table, key)] = (value, write)
+        self.queue.put(write)
+
+    def pendingValue(self, path, table, key):
+        """Returns the value of a write not yet committed, None if there is none"""
+        found = self.pending.get((path, table, key))
+        return found[0] if found else None
+
+    def flush(self):
+        """Waits until everything written so far is committed"""
+        if not self.is_alive():
+            return
+        done = threading.Event()
+        self.queue.put(done)
+        if not done.wait(WRITE_FLUSH_TIMEOUT):
+            logging.error("Cache writer did not flush in time")
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.time() + WRITE_FLUSH_INTERVAL
+            while not isinstance(batch[-1], threading.Event):
+                try:
+                    batch.append(self.queue.get(timeout=deadline - time.time()))
+                except (queue.Empty, ValueError):
+                    break
+            self.commit([write for write in batch if isinstance(write, tuple)])
+            for done in batch:
+                if isinstance(done, threading.Event):
+                    done.set()
+
+    def commit(self, writes):
+        paths = []
+        for write in writes:
+            if write[0] not in paths:
+                paths.append(write[0])
+        for path in paths:
+            con = Cache.threadConnection(path)
+            try:
+                with con:
+                    for write in writes:
+                        if write[0] != path:
+                            continue
+                        for query, parameters in write[1]:
+                            if isinstance(parameters, list):
+                                con.executemany(query, parameters)
+                            else:
+                                con.execute(query, parameters)
+            except Exception as e:
+                logging.error("Writing to the cache failed: {}".format(e))
+        with self.lock:
+            for write in writes:
+                for key in write[3]:
+                    pendingKey = (write[0], write[2], key)
+                    if self.pending.get(pendingKey, (0, 0))[1] is write:
+                        del self.pending[pendingKey]
+
+
 class Cache(object):
     # Cache checks PATH_TO_CACHE when init, so you can set this on a
     # central place for all Cache instances.
@@ -49,18 +228,56 @@ class Cache(object):
     # Dirty trick to know if we updated the DB this launch
     WAS_UPDATED = False
 
+    # The connections of every thread, one per database file. They are opened
+    # on first use and kept, so a Cache is cheap to create anywhere.
+    THREAD_CONNECTIONS = threading.local()
+
+    # How many prepared statements each connection keeps
+    CACHED_STATEMENTS = 64
+
+    # All writes go through this thread, see CacheWriter
+    WRITER = CacheWriter()
+
+    # Hot rows of the cache table, see FrontCache
+    FRONT = FrontCache()
+
     def __init__(self, pathToSQLiteFile="cache.sqlite3"):
         """pathToSQLiteFile=path to sqlite-file to save the cache. will be ignored if you set Cache.PATH_TO_CACHE
         before init
         """
         if Cache.PATH_TO_CACHE:
             pathToSQLiteFile = Cache.PATH_TO_CACHE
-        self.con = sqlite3.connect(pathToSQLiteFile)
+        self.path = pathToSQLiteFile
+        self.con = Cache.threadConnection(pathToSQLiteFile)
         if not Cache.VERSION_CHECKED:
             with Cache.SQLITE_WRITE_LOCK:
                 self.checkVersion()
         Cache.VERSION_CHECKED = True
 
+    @staticmethod
+    def threadConnection(pathToSQLiteFile):
+        """Returns the connection of the current thread to pathToSQLiteFile, the
+        sqlite3 module keeps the statements prepared for it
+        """
+        connections = getattr(Cache.THREAD_CONNECTIONS, "connections", None)
+        if connections is None:
+            connections = Cache.THREAD_CONNECTIONS.connections = {}
+        con = connections.get(pathToSQLiteFile)
+        if con is None:
+            con = sqlite3.connect(
+                pathToSQLiteFile, cached_statements=Cache.CACHED_STATEMENTS
+            )
+            # readers never wait for the writer, and commits don't fsync every time
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            connections[pathToSQLiteFile] = con
+        return con
+
+    @staticmethod
+    def flushWrites():
+        """Commits all pending writes, call it before the application ends"""
+        Cache.WRITER.flush()
+
     def checkVersion(self):
         query = "SELECT version FROM version;"
         version = 0
@@ -79,44 +296,132 @@ class Cache(object):
 
     def putIntoCache(self, key, value, max_age=60 * 60 * 24 * 3):
         """Putting something in the cache maxAge is maximum age in seconds"""
-        with Cache.SQLITE_WRITE_LOCK:
-            query = "DELETE FROM cache WHERE key = ?"
-            self.con.execute(query, (key,))
-            query = (
-                "INSERT INTO cache (key, data, modified, maxAge) VALUES (?, ?, ?, ?)"
-            )
-            self.con.execute(query, (key, value, time.time(), max_age))
-            self.con.commit()
+        row = (key, value, time.time(), max_age)
+        statements = [
+            ("DELETE FROM cache WHERE key = ?", (key,)),
+            (
+                "INSERT INTO cache (key, data, modified, maxAge) VALUES (?, ?, ?, ?)",
+                row,
+            ),
+        ]
+        Cache.WRITER.write(self.path, statements, "cache", {key: row})
+        Cache.FRONT.put(self.path, row)
 
     def getFromCache(self, key, outdated=False):
         """Getting a value from cache
         key = the key for the value
         outdated = returns the value also if it is outdated
         """
-        query = "SELECT key, data, modified, maxage FROM cache WHERE key = ?"
-        founds = self.con.execute(query, (key,)).fetchall()
-        if len(founds) == 0:
-            return None
-        elif founds[0][2] + founds[0][3] < time.time() and not outdated:
+        entry = Cache.FRONT.get(self.path, key)
+        if entry is not None:
+            return entry[0][1]
+        return self._getFromDatabase(key, outdated)
+
+    def _getFromDatabase(self, key, outdated):
+        """getFromCache for a key the front cache does not have, the row is put
+        into it
+        """
+        row = self._getRow(key)
+        if row is None:
             return None
+        elif row[2] + row[3] < time.time():
+            return row[1] if outdated else None
         else:
-            return founds[0][1]
+            Cache.FRONT.put(self.path, row)
+            return row[1]
+
+    def getDecodedFromCache(self, key, decode, outdated=False):
+        """Like getFromCache, but returns decode(value). The decoded value is kept
+        in memory with the row, so it is shared by all callers and must not be
+        changed.
+        """
+        entry = Cache.FRONT.get(self.path, key)
+        if entry is None:
+            value = self._getFromDatabase(key, outdated)
+        elif entry[1] is NOT_DECODED:
+            value = entry[0][1]
+        else:
+            return entry[1]
+        if not value:
+            return None
+        decoded = decode(value)
+        Cache.FRONT.setDecoded(self.path, key, decoded)
+        return decoded
+
+    def putMany(self, items, max_age=60 * 60 * 24 * 3):
+        """Putting all key: value of the dict items in the cache, in one transaction"""
+        now = time.time()
+        rows = [(key, value, now, max_age) for key, value in items.items()]
+        if not rows:
+            return
+        statements = [
+            ("DELETE FROM cache WHERE key = ?", [(row[0],) for row in rows]),
+            (
+                "INSERT INTO cache (key, data, modified, maxAge) VALUES (?, ?, ?, ?)",
+                rows,
+            ),
+        ]
+        Cache.WRITER.write(
+            self.path, statements, "cache", {row[0]: row for row in rows}
+        )
+        for row in rows:
+            Cache.FRONT.put(self.path, row)
+
+    def getMany(self, keys, outdated=False):
+        """Getting the values of many keys at once, returns a dict key: value of the
+        keys found. The keys not in memory are queried in chunks of MANY_CHUNK.
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            entry = Cache.FRONT.get(self.path, key)
+            if entry is not None:
+                found[key] = entry[0][1]
+            else:
+                row = Cache.WRITER.pendingValue(self.path, "cache", key)
+                if row is None:
+                    missing.append(key)
+                elif row[2] + row[3] >= time.time() or outdated:
+                    found[key] = row[1]
+        now = time.time()
+        for start in range(0, len(missing), MANY_CHUNK):
+            chunk = missing[start : start + MANY_CHUNK]
+            query = "SELECT key, data, modified, maxage FROM cache WHERE key IN ({})"
+            query = query.format(",".join("?" * len(chunk)))
+            for row in self.con.execute(query, chunk).fetchall():
+                if row[2] + row[3] >= now:
+                    Cache.FRONT.put(self.path, row)
+                elif not outdated:
+                    continue
+                found[row[0]] = row[1]
+        return found
+
+    def _getRow(self, key):
+        pending = Cache.WRITER.pendingValue(self.path, "cache", key)
+        if pending is not None:
+            return pending
+        query = "SELECT key, data, modified, maxage FROM cache WHERE key = ?"
+        founds = self.con.execute(query, (key,)).fetchall()
+        return founds[0] if founds else None
 
     def putPlayerName(self, name, status):
         """Putting a playername into the cache"""
-        with Cache.SQLITE_WRITE_LOCK:
-            query = "DELETE FROM playernames WHERE charname = ?"
-            self.con.execute(query, (name,))
-            query = (
-                "INSERT INTO playernames (charname, status, modified) VALUES (?, ?, ?)"
-            )
-            self.con.execute(query, (name, status, time.time()))
-            self.con.commit()
+        statements = [
+            ("DELETE FROM playernames WHERE charname = ?", (name,)),
+            (
+                "INSERT INTO playernames (charname, status, modified) VALUES (?, ?, ?)",
+                (name, status, time.time()),
+            ),
+        ]
+        Cache.WRITER.write(self.path, statements, "playernames", {name: status})
 
     def getPlayerName(self, name):
         """Getting back infos about playername from Cache. Returns None if the name was not found, else it returns
         the status
         """
+        pending = Cache.WRITER.pendingValue(self.path, "playernames", name)
+        if pending is not None:
+            return pending
         selectquery = "SELECT charname, status FROM playernames WHERE charname = ?"
         founds = self.con.execute(selectquery, (name,)).fetchall()
         if len(founds) == 0:
@@ -126,17 +431,22 @@ class Cache(object):
 
     def putAvatar(self, name, data):
         """Put the picture of an player into the cache"""
-        with Cache.SQLITE_WRITE_LOCK:
-            # data is a blob, so we have to change it to buffer
-            data = to_blob(data)
-            query = "DELETE FROM avatars WHERE charname = ?"
-            self.con.execute(query, (name,))
-            query = "INSERT INTO avatars (charname, data, modified) VALUES (?, ?, ?)"
-            self.con.execute(query, (name, data, time.time()))
-            self.con.commit()
+        # data is a blob, so we have to change it to buffer
+        data = to_blob(data)
+        statements = [
+            ("DELETE FROM avatars WHERE charname = ?", (name,)),
+            (
+                "INSERT INTO avatars (charname, data, modified) VALUES (?, ?, ?)",
+                (name, data, time.time()),
+            ),
+        ]
+        Cache.WRITER.write(self.path, statements, "avatars", {name: data})
 
     def getAvatar(self, name):
         """Getting the avatars_pictures data from the Cache. Returns None if there is no entry in the cache"""
+        pending = Cache.WRITER.pendingValue(self.path, "avatars", name)
+        if pending is not None:
+            return None if pending is DELETED else from_blob(pending)
         select_query = "SELECT data FROM avatars WHERE charname = ?"
         founds = self.con.execute(select_query, (name,)).fetchall()
         if len(founds) == 0:
@@ -148,10 +458,8 @@ class Cache(object):
 
     def removeAvatar(self, name):
         """Removing an avatar from the cache"""
-        with Cache.SQLITE_WRITE_LOCK:
-            query = "DELETE FROM avatars WHERE charname = ?"
-            self.con.execute(query, (name,))
-            self.con.commit()
+        statements = [("DELETE FROM avatars WHERE charname = ?", (name,))]
+        Cache.WRITER.write(self.path, statements, "avatars", {name: DELETED})
 
     def recallAndApplySettings(self, responder, settings_identifier):
         version = self.getFromCache("version")
@@ -194,35 +502,60 @@ class Cache(object):
         self, src, dst, src_id=None, dst_id=None, max_age=60 * 60 * 24 * 14
     ):
         """ """
-        with Cache.SQLITE_WRITE_LOCK:
-            # data is a blob, so we have to change it to buffer
-            query = "DELETE FROM jumpbridge WHERE src LIKE ? or dst LIKE ? or src LIKE ? or dst LIKE ?"
-            self.con.execute(query, (src, src, dst, dst))
-            query = "INSERT INTO jumpbridge (src, dst, id_src, id_dst, modified, maxage) VALUES (?, ?, ?, ?, ?, ?)"
-            self.con.execute(query, (src, dst, src_id, dst_id, time.time(), max_age))
-            self.con.commit()
+        statements = [
+            (
+                "DELETE FROM jumpbridge WHERE src LIKE ? or dst LIKE ? or src LIKE ? or dst LIKE ?",
+                (src, src, dst, dst),
+            ),
+            (
+                "INSERT INTO jumpbridge (src, dst, id_src, id_dst, modified, maxage) VALUES (?, ?, ?, ?, ?, ?)",
+                (src, dst, src_id, dst_id, time.time(), max_age),
+            ),
+        ]
+        Cache.WRITER.write(self.path, statements)
 
     def clearJumpGate(self, src):
         """ """
-        with Cache.SQLITE_WRITE_LOCK:
-            # data is a blob, so we have to change it to buffer
-            query = "DELETE FROM jumpbridge WHERE src LIKE ? or dst LIKE ?"
-            self.con.execute(query, (src, src))
-            self.con.commit()
+        query = "DELETE FROM jumpbridge WHERE src LIKE ? or dst LIKE ?"
+        Cache.WRITER.write(self.path, [(query, (src, src))])
 
     def hasJumpGate(self, src) -> bool:
         """ """
-        with Cache.SQLITE_WRITE_LOCK:
-            # data is a blob, so we have to change it to buffer
-            query = "SELECT SRC FROM jumpbridge WHERE src LIKE ? or dst LIKE ?"
-            res = self.con.execute(query, (src, src)).fetchall()
+        # the jump bridges are only kept in the database, so wait for their writes
+        Cache.flushWrites()
+        query = "SELECT SRC FROM jumpbridge WHERE src LIKE ? or dst LIKE ?"
+        res = self.con.execute(query, (src, src)).fetchall()
         return len(res) > 0
 
     def getJumpGates(self, src=None):
         """ """
+        Cache.flushWrites()
         selectquery = "SELECT src, ' ', dst FROM jumpbridge "
         founds = self.con.execute(selectquery, ()).fetchall()
         if len(founds) == 0:
             return None
         else:
             return founds
+
+    def putCheckpoints(self, checkpoints, max_age=60 * 60 * 24):
+        """Saving the read positions of the chat logs, checkpoints is a list of
+        (path, inode, size, offset, parsed), parsed is the time of the last line read.
+        Checkpoints older than max_age are removed
+        """
+        statements = [
+            ("DELETE FROM checkpoints WHERE parsed < ?", (time.time() - max_age,))
+        ]
+        query = "INSERT OR REPLACE INTO checkpoints (path, inode, size, offset, parsed) VALUES (?, ?, ?, ?, ?)"
+        statements.append((query, list(checkpoints)))
+        Cache.WRITER.write(self.path, statements)
+
+    def getCheckpoints(self):
+        """Returns a dict path: (inode, size, offset, parsed) of the saved read positions"""
+        Cache.flushWrites()
+        query = "SELECT path, inode, size, offset, parsed FROM checkpoints"
+        founds = self.con.execute(query).fetchall()
+        return {found[0]: found[1:] for found in founds}
+
+
+# whatever is still queued gets written when the interpreter exits
+atexit.register(Cache.flushWrites)
@@ -55,6 +55,12 @@ def updateDatabase(oldVersion, con) -> bool:
             "UPDATE version SET version = 4",
         ]
 
+    if oldVersion < 5:
+        queries += [
+            "CREATE TABLE checkpoints (path VARCHAR PRIMARY KEY, inode INT, size INT, offset INT, parsed INT)",
+            "UPDATE version SET version = 5",
+        ]
+
     for query in queries:
         con.execute(query)
     for update in databaseUpdates:
@@ -0,0 +1,106 @@
+###########################################################################
+#  Spyglass - Visual Intel Chat Analyzer								  #
+#  Copyright (C) 2017 Crypta Eve (crypta@crypta.tech)                     #
+# 																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+# 																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+# 																		  #
+# 																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+import os
+import re
+import time
+import calendar
+import datetime
+import threading
+import collections
+
+# EVE names the logs like room_20210210_223941_1350114619.txt
+LOG_NAME_RE = re.compile(r"^(.+)_(\d{8})_(\d{6})_(\d+)\.txt$")
+
+# EVE ends every session at the daily downtime, so a log is never written to
+# longer than this after the session started
+MAX_SESSION_SECS = 60 * 60 * 24
+
+ChatLog = collections.namedtuple("ChatLog", "path room sessionStart charId")
+
+
+def parseLogName(path):
+    """Returns the ChatLog for the filename of path, None if it is no chat log"""
+    match = LOG_NAME_RE.match(os.path.basename(path))
+    if not match:
+        return None
+    room, day, daytime, charId = match.groups()
+    fields = (day[:4], day[4:6], day[6:], daytime[:2], daytime[2:4], daytime[4:])
+    try:
+        sessionStart = datetime.datetime(*map(int, fields))
+    except ValueError:
+        return None
+    return ChatLog(path, room, calendar.timegm(sessionStart.timetuple()), charId)
+
+
+class ChatLogDirectory(object):
+    """Index of the chat logs in the log directory. The room and session start come
+    from the filenames, so keeping the index current needs no stat of the files.
+    One instance is shared by the file watcher, the chat parser and the rescan.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.logs = {}  # path: ChatLog
+        self.lock = threading.Lock()
+        self.update()
+
+    def update(self):
+        """Reads the directory again, only names not yet known are parsed.
+        Returns the sets of added and removed paths.
+        """
+        with self.lock:
+            logs = {}
+            with os.scandir(self.path) as entries:
+                for entry in entries:
+                    log = self.logs.get(entry.path)
+                    if log is None:
+                        if not entry.is_file():
+                            continue
+                        log = parseLogName(entry.path)
+                        if log is None:
+                            continue
+                    logs[entry.path] = log
+            added = logs.keys() - self.logs.keys()
+            removed = self.logs.keys() - logs.keys()
+            self.logs = logs
+        return added, removed
+
+    def roomName(self, path):
+        log = self.logs.get(path)
+        return log.room if log else None
+
+    def recentLogs(self, maxAge, rooms=None):
+        """Returns the paths of the logs modified within the last maxAge seconds,
+        only of the given rooms if rooms is set. Only the logs whose session could
+        still be running that long ago are looked at with a stat.
+        """
+        now = time.time()
+        recent = []
+        for log in list(self.logs.values()):
+            if rooms is not None and log.room not in rooms:
+                continue
+            if now - log.sessionStart > maxAge + MAX_SESSION_SECS:
+                continue
+            try:
+                if now - os.path.getmtime(log.path) < maxAge:
+                    recent.append(log.path)
+            except OSError:
+                pass
+        return recent
@@ -0,0 +1,83 @@
+###########################################################################
+#  Spyglass - Visual Intel Chat Analyzer								  #
+#  Copyright (C) 2017 Crypta Eve (crypta@crypta.tech)                     #
+# 																		  #
+#  This program is free software: you can redistribute it and/or modify	  #
+#  it under the terms of the GNU General Public License as published by	  #
+#  the Free Software Foundation, either version 3 of the License, or	  #
+#  (at your option) any later version.									  #
+# 																		  #
+#  This program is distributed in the hope that it will be useful,		  #
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of		  #
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.	 See the		  #
+#  GNU General Public License for more details.							  #
+# 																		  #
+# 																		  #
+#  You should have received a copy of the GNU General Public License	  #
+#  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
+###########################################################################
+
+from collections import deque
+
+
+class AhoCorasick(object):
+    """Aho-Corasick automaton, finds all occurrences of a fixed set of patterns
+    in a single pass over the text, independent of the number of patterns.
+    """
+
+    def __init__(self, patterns):
+        self.goto = [{}]  # state -> {char: next state}
+        self.fail = [0]  # state -> state of the longest proper suffix
+        self.output = [()]  # state -> patterns ending in this state
+        for pattern in patterns:
+            self._addPattern(pattern)
+        self._buildFailLinks()
+
+    def _addPattern(self, pattern):
+        if not pattern:
+            return
+        state = 0
+        for char in pattern:
+            nextState = self.goto[state].get(char)
+            if nextState is None:
+                nextState = len(self.goto)
+                self.goto[state][char] = nextState
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(())
+            state = nextState
+        if pattern not in self.output[state]:
+            self.output[state] = self.output[state] + (pattern,)
+
+    def _buildFailLinks(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nextState in self.goto[state].items():
+                queue.append(nextState)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nextState] = self.goto[fallback].get(char, 0)
+                self.output[nextState] = (
+                    self.output[nextState] + self.output[self.fail[nextState]]
+                )
+
+    def findAll(self, text):
+        """Returns a list of (start, end, pattern) for every occurrence of every
+        pattern in text, overlapping occurrences included
+        """
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        found = []
+        state = 0
+        for idx, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                end = idx + 1
+                for pattern in output[state]:
+                    found.append((end - len(pattern), end, pattern))
+        return found
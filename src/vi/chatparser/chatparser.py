@@ -17,17 +17,25 @@
 #  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
 ###########################################################################
 
+import calendar
+import codecs
+import collections
+import concurrent.futures
+import multiprocessing
 import datetime
+import heapq
 import os
+import sys
 import time
 import logging
 
-from bs4 import BeautifulSoup
 from vi import states
+from vi.cache.cache import Cache
+from vi.chatlogdirectory import ChatLogDirectory, parseLogName
 from PyQt6.QtWidgets import QMessageBox
 
-from .parser_functions import parseStatus
-from .parser_functions import parseUrls, parseShips, parseSystems
+from .parser_functions import annotateTexts, annotateInWorker, initAnnotationWorker
+from .parser_functions import SystemNameIndex
 
 # Names the local chatlogs could start with (depends on l10n of the client)
 LOCAL_NAMES = (
@@ -36,87 +44,382 @@ LOCAL_NAMES = (
     str("\u041B\u043E\u043A\u0430\u043B\u044C\u043D\u044B\u0439"),
 )
 
+# EVE starts every chat log with a header of this many lines
+HEADER_LINES = 12
+# The header is always within the first bytes of a log
+HEADER_BYTES = 4096
+# A rescan bisects a log until the part left to read is smaller than this
+BISECT_MIN_BYTES = 16 * 1024
+# How much is read at a bisect position to find the next complete line
+BISECT_CHUNK_BYTES = 4096
+
+# How many processes annotate the texts of a rescan at most
+RESCAN_WORKERS = 4
+# A rescan with fewer new texts is annotated in this process. A text takes about
+# 30 us to annotate, while a spawned worker has to import the application first,
+# which takes a second or more. With 4 workers the pool only pays off above
+# about 50k distinct texts, like a rescan of an hour of many busy channels.
+PARALLEL_ANNOTATION_MIN = 50000
+# How many texts a worker annotates per task
+ANNOTATION_CHUNK = 1000
+
+# A clear without a system may answer a request in one of the last messages
+CLEAR_ANSWER_SEARCH = 4
+
+# The same report posted again within this many seconds in another room is
+# collapsed into the first one, unless the status of its systems changed since
+INTEL_DEDUP_SECS = 60
+
+# How many different message texts keep their annotation
+ANNOTATION_CACHE_SIZE = 4096
+
+
+class AnnotationCache(object):
+    """Bounded LRU cache of annotated message texts. An entry is the tuple
+    (html, system ids, status) for the text as posted.
+    """
+
+    def __init__(self, maxSize=ANNOTATION_CACHE_SIZE):
+        self.maxSize = maxSize
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text):
+        entry = self.entries.get(text)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(text)
+        self.hits += 1
+        return entry
+
+    def put(self, text, entry):
+        self.entries[text] = entry
+        if len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hitRate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class LogTimestamps(object):
+    """Parses the "YYYY.MM.DD HH:MM:SS" timestamps of one chat log by slicing the
+    fields at their fixed positions. The lines of a log share very few dates, so
+    the date part is converted only when it changes.
+    """
+
+    def __init__(self):
+        self.dateStr = None
+        self.dateParts = None
+        self.dateEpoch = 0
+
+    def parse(self, timeStr):
+        """Returns (timestamp, epoch) with epoch as int seconds since 1970 UTC,
+        raises ValueError if timeStr is no timestamp
+        """
+        if (
+            len(timeStr) != 19
+            or timeStr[10] != " "
+            or timeStr[13] != ":"
+            or timeStr[16] != ":"
+        ):
+            raise ValueError("Not a timestamp: {}".format(timeStr))
+        dateStr = timeStr[:10]
+        if dateStr != self.dateStr:
+            if dateStr[4] != "." or dateStr[7] != ".":
+                raise ValueError("Not a timestamp: {}".format(timeStr))
+            date = datetime.date(int(dateStr[:4]), int(dateStr[5:7]), int(dateStr[8:]))
+            self.dateEpoch = calendar.timegm(date.timetuple())
+            self.dateParts = (date.year, date.month, date.day)
+            self.dateStr = dateStr
+        hour = int(timeStr[11:13])
+        minute = int(timeStr[14:16])
+        second = int(timeStr[17:])
+        timestamp = datetime.datetime(*self.dateParts, hour, minute, second)
+        return timestamp, self.dateEpoch + hour * 3600 + minute * 60 + second
+
 
 class ChatParser(object):
     """ChatParser will analyze every new line that was found inside the Chatlogs."""
 
-    def __init__(self, path, rooms, systems, inteltime):
+    def __init__(
+        self, path, rooms, systems, inteltime, readErrorCallback=None, logDirectory=None
+    ):
         """path = the path with the logs
-        rooms = the rooms to parse"""
+        rooms = the rooms to parse
+        readErrorCallback = called with path and error text if a log can't be read
+        logDirectory = the ChatLogDirectory of path, if one is shared"""
         self.path = path  # the path with the chatlog
         self.rooms = rooms  # the rooms to watch (excl. local)
         self.systems = systems  # the known systems as dict name: system
+        self.systemsById = {
+            system.systemId: system for system in (systems or {}).values()
+        }
+        # the names and ids only, to hand them to other processes
+        self.systemIds = {
+            name: system.systemId for name, system in (systems or {}).items()
+        }
+        # built once for the map the systems are from
+        self.systemIndex = SystemNameIndex(systems.keys() if systems else ())
+        # only valid for these systems, a new map gets a new parser
+        self.annotationCache = AnnotationCache()
+        # annotations of a rescan, too many for the cache
+        self.batchAnnotations = {}
         self.intelTime = inteltime  # 20 min intel time
         self.fileData = {}  # informations about the files in the directory
-        self.knownMessages = []  # message we allready analyzed
+        self.knownMessages = set()  # message we allready analyzed
+        self.messageHistory = collections.deque()  # the known messages in order
+        self.recentMessages = {}  # the last messages per room, for clear answers
+        # (normalized text, status): first message reporting it
+        self.recentIntel = {}
+        # system id: (its last status, the message that changed it to that)
+        self.systemStatuses = {}
+        self.dedupSecs = INTEL_DEDUP_SECS
         self.locations = {}  # informations about the location of a char
+        self.timestamps = LogTimestamps()  # for lines not read from a file
         self.ignoredPaths = []
+        self.readErrorCallback = readErrorCallback
+        self.logDirectory = logDirectory or ChatLogDirectory(path)
         self._collectInitFileData(path)
 
     def _collectInitFileData(self, path):
-        currentTime = time.time()
         maxDiff = 60 * 60 * 24  # what is 1 day in seconds
-        for filename in os.listdir(path):
-            fullPath = os.path.join(path, filename)
-            fileTime = os.path.getmtime(fullPath)
-            if currentTime - fileTime < maxDiff:
-                self.addFile(fullPath)
-
-    def roomNameFromFileName(self, filename):
-        # Checking if we must do anything with the changed file.
-        # We only need those which name is in the rooms-list
-        # EvE names the file like room_20210210_223941_1350114619.txt, so we don't need
-        # the last 31 chars
-        noIdStr = filename[: filename.rindex("_")]
-        noTimeStr = noIdStr[: noIdStr.rindex("_")]
-        return noTimeStr[: noTimeStr.rindex("_")]
+        try:
+            checkpoints = Cache().getCheckpoints()
+        except Exception as e:
+            logging.error("Unable to load the log checkpoints: {}".format(e))
+            checkpoints = {}
+        self.logDirectory.update()
+        paths = self.logDirectory.recentLogs(maxDiff)
+        for fullPath in paths:
+            self._startFile(fullPath, checkpoints.get(fullPath))
+        # the intel still inside the intel time, handed on by the parser thread
+        self.initialMessages = self._parseTails(paths, False)
+
+    def _startFile(self, path, checkpoint=None):
+        """Opens the log at path at its first line inside the intel time. The
+        checkpoint (inode, size, offset, parsed) of an earlier run tells if that
+        line is before or after the offset, so only that side is bisected
+        """
+        try:
+            data = self._openFile(path)
+            low = 0
+            high = os.fstat(data["handle"].fileno()).st_size
+            if checkpoint:
+                inode, size, offset, parsed = checkpoint
+                # a log that shrank was replaced, its checkpoint is of no use
+                if data["inode"] == inode and size <= high:
+                    data["lastEpoch"] = parsed
+                    if parsed < time.time() - 60 * self.intelTime:
+                        low = offset
+                    else:
+                        high = offset
+            self._seekIntelWindow(data, low, high)
+        except OSError as e:
+            logging.error("Unable to start log {}: {}".format(path, e))
+
+    def roomName(self, path):
+        """Returns the room of the log at path, None if path is no chat log"""
+        roomname = self.logDirectory.roomName(path)
+        if roomname is None:
+            # not indexed yet, the directory is only updated on its next change
+            log = parseLogName(path)
+            roomname = log.room if log else None
+        return roomname
+
+    def _openFile(self, path):
+        """(Re)opens the log at path and rewinds the read state to the start of the file"""
+        data = self.fileData.setdefault(path, {})
+        if data.get("handle"):
+            data["handle"].close()
+        handle = open(path, "rb")
+        data["handle"] = handle
+        data["inode"] = os.fstat(handle.fileno()).st_ino
+        data["offset"] = 0
+        data["decoder"] = codecs.getincrementaldecoder("utf-16-le")()
+        data["pending"] = ""
+        data["headerLines"] = HEADER_LINES
+        data.setdefault("timestamps", LogTimestamps())
+        return data
+
+    def _readHeader(self, handle):
+        """Returns the complete header lines of a log with a bounded read from its
+        start
+        """
+        handle.seek(0)
+        content = handle.read(HEADER_BYTES).decode("utf-16-le", errors="ignore")
+        return content.split("\n")[:-1][:HEADER_LINES]
+
+    def _lineTimestampAfter(self, handle, position, timestamps):
+        """Returns (offset, epoch) of the first line with a timestamp starting
+        after position, None if there is none in the next BISECT_CHUNK_BYTES
+        """
+        position -= position % 2
+        handle.seek(position)
+        chunk = handle.read(BISECT_CHUNK_BYTES)
+        lineEnds = [
+            idx
+            for idx in range(0, len(chunk) - 1, 2)
+            if chunk[idx] == 0x0A and chunk[idx + 1] == 0
+        ]
+        for start, end in zip(lineEnds, lineEnds[1:]):
+            line = chunk[start + 2 : end].decode("utf-16-le", errors="ignore")
+            timeStart = line.find("[") + 1
+            timeEnds = line.find("]")
+            try:
+                epoch = timestamps.parse(line[timeStart:timeEnds].strip())[1]
+            except ValueError:
+                continue
+            return position + start + 2, epoch
+        return None
+
+    def _seekIntelWindow(self, data, low=0, high=None):
+        """Moves the read position of a freshly opened log close to its first line
+        inside the intel time. Lines are in timestamp order, so the file is bisected
+        by byte offset, the few older lines left are skipped while parsing. The
+        line is known to start between the offsets low and high.
+        """
+        handle = data["handle"]
+        oldestEpoch = time.time() - 60 * self.intelTime
+        if high is None:
+            high = os.fstat(handle.fileno()).st_size
+        while high - low > BISECT_MIN_BYTES:
+            found = self._lineTimestampAfter(
+                handle, (low + high) // 2, data["timestamps"]
+            )
+            if found is None or found[1] >= oldestEpoch:
+                high = (low + high) // 2
+            else:
+                low = found[0]
+        if low:
+            data["headerLines"] = 0
+            data["offset"] = low
+
+    def _readAppendedLines(self, path):
+        """Reads and decodes only the bytes appended to path since the last call.
+        Only complete lines are returned, a partial trailing line is kept until
+        the next read. The file is read again from the start if it was truncated
+        or replaced.
+        """
+        data = self.fileData.get(path)
+        if not data or not data.get("handle"):
+            data = self._openFile(path)
+        else:
+            pathStat = os.stat(path)
+            if pathStat.st_ino != data["inode"] or pathStat.st_size < data["offset"]:
+                logging.info("Log file {} was replaced, reading it again".format(path))
+                data = self._openFile(path)
+        handle = data["handle"]
+        handle.seek(data["offset"])
+        content = data["decoder"].decode(handle.read())
+        data["offset"] = handle.tell()
+        lines = (data["pending"] + content).split("\n")
+        data["pending"] = lines.pop()
+        if data["headerLines"]:
+            headerLines = min(data["headerLines"], len(lines))
+            data["headerLines"] -= headerLines
+            lines = lines[headerLines:]
+        return lines
 
     def addFile(self, path):
         lines = None
-        content = ""
-        filename = os.path.basename(path)
-        roomname = self.roomNameFromFileName(filename)
+        roomname = self.roomName(path)
+        if roomname is None:
+            self.ignoredPaths.append(path)
+            logging.debug("Ignoring {}, it is no chat log".format(path))
+            return None
         try:
-            with open(path, "r", encoding="utf-16-le") as f:
-                content = f.read()
+            lines = self._readAppendedLines(path)
             logging.info("Add room " + roomname + " to list.")
         except Exception as e:
             self.ignoredPaths.append(path)
-            QMessageBox.warning(
-                None,
-                "Read a log file failed!",
-                "File: {0} - problem: {1}".format(path, str(e)),
-                QMessageBox.Ok,
-            )
+            logging.error("Read of log file {} failed: {}".format(path, e))
+            if self.readErrorCallback:
+                self.readErrorCallback(path, str(e))
+            else:
+                QMessageBox.warning(
+                    None,
+                    "Read a log file failed!",
+                    "File: {0} - problem: {1}".format(path, str(e)),
+                    QMessageBox.Ok,
+                )
             return None
 
-        lines = content.split("\n")
-        if path not in self.fileData or (
-            roomname in LOCAL_NAMES and "charname" not in self.fileData.get(path, [])
-        ):
-            self.fileData[path] = {}
-            if roomname in LOCAL_NAMES:
-                charname = None
-                sessionStart = None
-                # for local-chats we need more infos
-                for line in lines:
-                    if "Listener:" in line:
-                        charname = line[line.find(":") + 1 :].strip()
-                    elif "Session started:" in line:
-                        sessionStr = line[line.find(":") + 1 :].strip()
-                        sessionStart = datetime.datetime.strptime(
-                            sessionStr, "%Y.%m.%d %H:%M:%S"
-                        )
-
-                    if charname and sessionStart:
-                        self.fileData[path]["charname"] = charname
-                        self.fileData[path]["sessionstart"] = sessionStart
-                        break
-        self.fileData[path]["lines"] = len(lines)
+        data = self.fileData[path]
+        if roomname in LOCAL_NAMES and "charname" not in data:
+            # for local-chats we need more infos
+            self._readHeaderInfo(data)
         logging.debug([m.encode("ascii", "ignore") for m in lines])
         return lines
 
-    def _lineToMessage(self, line, roomname):
+    def _readHeaderInfo(self, data):
+        """Sets charname and sessionstart of a Local log from its header. Only the
+        header is read, and only until both are found, the body is never scanned
+        """
+        charname = None
+        sessionStart = None
+        for line in self._readHeader(data["handle"]):
+            if "Listener:" in line:
+                charname = line[line.find(":") + 1 :].strip()
+            elif "Session started:" in line:
+                sessionStr = line[line.find(":") + 1 :].strip()
+                try:
+                    sessionStart = data["timestamps"].parse(sessionStr)[0]
+                except ValueError:
+                    # the header may not be written completely yet
+                    pass
+        if charname and sessionStart:
+            data["charname"] = charname
+            data["sessionstart"] = sessionStart
+
+    def saveCheckpoints(self):
+        """Saves the read position of every log to the cache, so the next start
+        can continue there instead of reading the logs again
+        """
+        checkpoints = []
+        for path, data in self.fileData.items():
+            if not data.get("handle") or data["headerLines"]:
+                continue
+            if data.get("lastEpoch") is None:
+                continue
+            # the offset of the first byte not yet part of a complete line
+            buffered = data["decoder"].getstate()[0]
+            pendingSize = len(data["pending"].encode("utf-16-le")) + len(buffered)
+            offset = data["offset"] - pendingSize
+            try:
+                size = os.fstat(data["handle"].fileno()).st_size
+            except OSError:
+                continue
+            checkpoints.append((path, data["inode"], size, offset, data["lastEpoch"]))
+        try:
+            Cache().putCheckpoints(checkpoints)
+        except Exception as e:
+            logging.error("Unable to save the log checkpoints: {}".format(e))
+
+    def close(self):
+        """Saves the checkpoints and closes all log files held open for tailing"""
+        self.saveCheckpoints()
+        logging.info(
+            "Annotation cache: {} hits, {} misses, hit rate {:.1%}".format(
+                self.annotationCache.hits,
+                self.annotationCache.misses,
+                self.annotationCache.hitRate,
+            )
+        )
+        for data in self.fileData.values():
+            if data.get("handle"):
+                data["handle"].close()
+                data["handle"] = None
+
+    def _lineToMessage(self, line, roomname, timestamps=None):
 
         if roomname not in self.rooms:
             return None
@@ -126,13 +429,11 @@ class ChatParser(object):
         timeEnds = line.find("]")
         timeStr = line[timeStart:timeEnds].strip()
         try:
-            timestamp = datetime.datetime.strptime(timeStr, "%Y.%m.%d %H:%M:%S")
+            timestamp, epoch = (timestamps or self.timestamps).parse(timeStr)
         except ValueError:
             return None
 
-        if timestamp < datetime.datetime.utcnow() - datetime.timedelta(
-            minutes=self.intelTime
-        ):
+        if epoch < time.time() - 60 * self.intelTime:
             logging.debug(
                 "Skip {} Room:{}".format(
                     line.encode("ascii", "ignore"), roomname.encode("ascii", "ignore")
@@ -142,60 +443,150 @@ class ChatParser(object):
 
         # finding the username of the poster
         userEnds = line.find(">")
-        username = line[timeEnds + 1 : userEnds].strip()
+        username = sys.intern(line[timeEnds + 1 : userEnds].strip())
         # finding the pure message
         text = line[userEnds + 1 :].strip()  # text will the text to work an
-        originalText = text
-        formatedText = "<rtext>{0}</rtext>".format(text)
-        soup = BeautifulSoup(formatedText, "html.parser")
-        rtext = soup.select("rtext")[0]
-        systems = set()
-        upperText = text.upper()
-
-        message = Message(
-            roomname, "", timestamp, username, systems, text, originalText
+
+        message = Message(roomname, "", timestamp, username, (), text)
+        self._forgetMessagesBefore(
+            datetime.datetime.utcnow() - datetime.timedelta(minutes=self.intelTime)
         )
         # May happen if someone plays > 1 account
         if message in self.knownMessages:
             message.status = states.IGNORE
             return message
-
-        while parseShips(rtext):
-            continue
-        while parseUrls(rtext):
-            continue
-        while parseSystems(self.systems, rtext, systems):
-            continue
-        parsedStatus = parseStatus(rtext)
+        annotation = self.annotationCache.get(text)
+        if annotation is None:
+            annotation = self.batchAnnotations.get(text) or self._annotate([text])[0]
+            self.annotationCache.put(text, annotation)
+        html, systemIds, parsedStatus = annotation
         status = parsedStatus if parsedStatus is not None else states.ALARM
 
+        # The systems follow from the text, so the same text and status means
+        # the same report
+        intelKey = (" ".join(text.upper().split()), status)
+        event = self.recentIntel.get(intelKey)
+        if event is not None and self._isRelay(event, roomname, timestamp):
+            event.relayRooms += (roomname,)
+            message.status = states.IGNORE
+            message.duplicateOf = event
+            self.knownMessages.add(message)
+            self.messageHistory.append(message)
+            # a clear in this room may still answer the request it relays
+            self._rememberInRoom(roomname, message)
+            return message
+
+        if systemIds:
+            self.recentIntel[intelKey] = message
         # If message says clear and no system? Maybe an answer to a request?
-        if status == states.CLEAR and not systems:
-            maxSearch = 2  # we search only max_search messages in the room
-            for count, oldMessage in enumerate(
-                oldMessage
-                for oldMessage in self.knownMessages[-1::-1]
-                if oldMessage.room == roomname
-            ):
+        if status == states.CLEAR and not systemIds:
+            for oldMessage in reversed(self.recentMessages.get(roomname, ())):
+                oldMessage = oldMessage.duplicateOf or oldMessage
                 if oldMessage.systems and oldMessage.status == states.REQUEST:
-                    for system in oldMessage.systems:
-                        systems.add(system)
-                    break
-                if count > maxSearch:
+                    systemIds = oldMessage.systems
                     break
-        message.message = str(rtext)
+        message.message = html
         message.status = status
-        self.knownMessages.append(message)
-        if systems:
-            for system in systems:
-                system.messages.append(message)
+        message.systems = systemIds
+        for systemId in systemIds:
+            lastStatus, changedBy = self.systemStatuses.get(systemId, (None, None))
+            # a message older than the last change does not change the status now
+            if lastStatus != status and (
+                changedBy is None or timestamp >= changedBy.timestamp
+            ):
+                self.systemStatuses[systemId] = (status, message)
+        self.knownMessages.add(message)
+        self.messageHistory.append(message)
+        self._rememberInRoom(roomname, message)
+        for systemId in systemIds:
+            self.systemsById[systemId].messages.append(message)
         return message
 
+    def _rememberInRoom(self, roomname, message):
+        """Keeps message as one of the last of its room, for clear answers"""
+        if roomname not in self.recentMessages:
+            self.recentMessages[roomname] = collections.deque(
+                maxlen=CLEAR_ANSWER_SEARCH
+            )
+        self.recentMessages[roomname].append(message)
+
+    def _isRelay(self, first, roomname, timestamp):
+        """Returns whether a message of roomname at timestamp is a copy of first,
+        the first message of a report. Only a copy from another room within
+        dedupSecs is, and only while no message posted at or after first has
+        changed the status of one of the systems of the report.
+        """
+        if roomname in first.rooms:
+            return False
+        if abs((timestamp - first.timestamp).total_seconds()) > self.dedupSecs:
+            return False
+        for systemId in first.systems:
+            changedBy = self.systemStatuses.get(systemId, (None, None))[1]
+            if changedBy is not None and changedBy is not first:
+                if changedBy.timestamp >= first.timestamp:
+                    return False
+        return True
+
+    def _annotate(self, texts):
+        """Returns the annotations (html, system ids, status) of the texts, the
+        statuses are classified as one batch
+        """
+        return annotateTexts(texts, self.systemIds, self.systemIndex)
+
+    def _annotateInWorkers(self, texts):
+        """Like _annotate, but splits the texts over worker processes. Falls back
+        to _annotate if there are few texts, one cpu or no workers can be started
+        """
+        workers = min(RESCAN_WORKERS, multiprocessing.cpu_count())
+        if len(texts) < PARALLEL_ANNOTATION_MIN or workers < 2:
+            return self._annotate(texts)
+        chunks = [
+            texts[start : start + ANNOTATION_CHUNK]
+            for start in range(0, len(texts), ANNOTATION_CHUNK)
+        ]
+        try:
+            # not forked, this thread is one of many and a child could inherit a
+            # lock that one of the others holds
+            with concurrent.futures.ProcessPoolExecutor(
+                workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=initAnnotationWorker,
+                initargs=(self.systemIds,),
+            ) as pool:
+                return [
+                    annotation
+                    for annotations in pool.map(annotateInWorker, chunks)
+                    for annotation in annotations
+                ]
+        except Exception as e:
+            logging.error("Annotation in worker processes failed: {}".format(e))
+            return self._annotate(texts)
+
+    def _forgetMessagesBefore(self, oldestTime):
+        """Drops the known messages older than oldestTime, a line that old is
+        skipped anyway, so we don't need them to find duplicates any more. They
+        are removed from the messages of their systems as well.
+        """
+        history = self.messageHistory
+        while history and history[0].timestamp < oldestTime:
+            message = history.popleft()
+            self.knownMessages.discard(message)
+            intelKey = (" ".join(message.plainText.upper().split()), message.status)
+            if self.recentIntel.get(intelKey) is message:
+                del self.recentIntel[intelKey]
+            for systemId in message.systems:
+                systemMessages = self.systemsById[systemId].messages
+                if systemMessages and systemMessages[0] is message:
+                    systemMessages.popleft()
+                elif message in systemMessages:
+                    systemMessages.remove(message)
+
     def _parseLocal(self, path, line):
         message = []
         """ Parsing a line from the local chat. Can contain the system of the char
         """
-        charname = self.fileData[path]["charname"]
+        data = self.fileData[path]
+        charname = data["charname"]
         if charname not in self.locations:
             self.locations[charname] = {
                 "system": "?",
@@ -206,7 +597,7 @@ class ChatParser(object):
         timeStart = line.find("[") + 1
         timeEnds = line.find("]")
         timeStr = line[timeStart:timeEnds].strip()
-        timestamp = datetime.datetime.strptime(timeStr, "%Y.%m.%d %H:%M:%S")
+        timestamp = data["timestamps"].parse(timeStr)[0]
 
         # Finding the username of the poster
         userEnds = line.find(">")
@@ -234,41 +625,133 @@ class ChatParser(object):
                         system,
                     ],
                     "",
-                    "",
                     status,
                 )
         return message
 
     def fileModified(self, path, rescan=False):
+        lines = self._readLines(path, rescan)
+        if lines is None:
+            return []
+        return self._linesToMessages(path, lines)
+
+    def rescanFiles(self, paths):
+        """Reads the logs in paths again from the start of the intel time, the
+        messages are returned in timestamp order, so they can be applied as one
+        batch
+        """
+        return self._parseTails(paths, True)
+
+    def _parseTails(self, paths, rescan):
+        """Reads the logs in paths from their read positions, or from the start of
+        the intel time for a rescan. The distinct texts of all of them are
+        annotated at once, in worker processes if there are many. Returns the
+        messages in timestamp order.
+        """
+        linesPerFile = [self._readLines(path, rescan) for path in paths]
+        # a text already posted in the same room is mostly a message seen before,
+        # which is not annotated again
+        knownTexts = {
+            (message.room, message.plainText) for message in self.knownMessages
+        }
+        texts = {}
+        for path, lines in zip(paths, linesPerFile):
+            roomname = self.roomName(path)
+            if not lines or roomname not in self.rooms:
+                continue
+            for line in lines:
+                text = line[line.find(">") + 1 :].strip()
+                if (roomname, text) not in knownTexts:
+                    texts[text] = None
+        texts = [text for text in texts if text not in self.annotationCache.entries]
+        self.batchAnnotations = dict(zip(texts, self._annotateInWorkers(texts)))
+        # the lines of all logs are parsed in the order they were posted, so
+        # relays and status changes are seen as they happened
+        timedLines = [
+            self._timedLines(path, lines)
+            for path, lines in zip(paths, linesPerFile)
+            if lines
+        ]
         messages = []
+        try:
+            for epoch, path, roomname, line in heapq.merge(
+                *timedLines, key=lambda timedLine: timedLine[0]
+            ):
+                message = self._parseLine(path, roomname, line)
+                if message:
+                    messages.append(message)
+        finally:
+            self.batchAnnotations = {}
+        messages.sort(key=lambda message: message.timestamp)
+        return messages
+
+    def _readLines(self, path, rescan):
+        """Returns the new complete lines of path, None if the log is ignored"""
         if path in self.ignoredPaths:
-            return []
-        filename = os.path.basename(path)
-        roomname = self.roomNameFromFileName(filename)
-        if path not in self.fileData:
-            # seems eve created a new file. New Files have 12 lines header
-            self.fileData[path] = {"lines": 13}
+            return None
         if rescan:
-            oldLength = 13
-        else:
-            oldLength = self.fileData[path]["lines"]
+            # start again at the first line inside the intel time
+            try:
+                self._seekIntelWindow(self._openFile(path))
+            except OSError as e:
+                logging.error("Unable to rescan log {}: {}".format(path, e))
         lines = self.addFile(path)
         if path in self.ignoredPaths:
-            return []
-        for line in lines[oldLength - 1 :]:
-            line = line.strip()
-            if len(line) > 2:
-                message = None
-                if roomname in LOCAL_NAMES:
-                    message = self._parseLocal(path, line)
-                else:
-                    message = self._lineToMessage(line, roomname)
-                if message:
-                    messages.append(message)
+            return None
+        return lines
+
+    def _linesToMessages(self, path, lines):
+        messages = []
+        for epoch, path, roomname, line in self._timedLines(path, lines):
+            message = self._parseLine(path, roomname, line)
+            if message:
+                messages.append(message)
         return messages
 
+    def _timedLines(self, path, lines):
+        """Returns (epoch, path, room, line) for the lines of path, a line without
+        a timestamp gets the one of the line before. The epoch of the last line
+        is kept for the checkpoint of the log.
+        """
+        roomname = sys.intern(self.roomName(path))
+        data = self.fileData[path]
+        timestamps = data["timestamps"]
+        epoch = data.get("lastEpoch") or 0
+        timedLines = []
+        for line in lines:
+            timeStr = line[line.find("[") + 1 : line.find("]")].strip()
+            try:
+                epoch = timestamps.parse(timeStr)[1]
+            except ValueError:
+                pass
+            timedLines.append((epoch, path, roomname, line))
+        if epoch:
+            data["lastEpoch"] = epoch
+        return timedLines
+
+    def _parseLine(self, path, roomname, line):
+        line = line.strip()
+        if len(line) <= 2:
+            return None
+        if roomname in LOCAL_NAMES:
+            return self._parseLocal(path, line)
+        return self._lineToMessage(line, roomname, self.fileData[path]["timestamps"])
+
 
 class Message(object):
+    __slots__ = (
+        "room",
+        "message",
+        "timestamp",
+        "user",
+        "systems",
+        "status",
+        "plainText",
+        "widgets",
+        "relayRooms",
+        "duplicateOf",
+    )
+
     def __init__(
         self,
         room,
@@ -276,7 +759,6 @@ class Message(object):
         timestamp,
         user,
         systems,
-        upperText,
         plainText="",
         status=states.ALARM,
     ):
@@ -284,12 +766,24 @@ class Message(object):
         self.message = message  # the messages text
         self.timestamp = timestamp  # time stamp of the massage
         self.user = user  # user who posted the message
-        self.systems = systems  # list of systems mentioned in the message
+        # ids of the systems mentioned in the message, the name for a location
+        self.systems = systems
         self.status = status  # status related to the message
-        self.upperText = upperText  # the text in UPPER CASE
         self.plainText = plainText  # plain text of the message, as posted
-        # if you add the message to a widget, please add it to widgets
-        self.widgets = []
+        # if you add the message to a widget, please make widgets a list of them
+        self.widgets = ()
+        self.relayRooms = ()  # other rooms the same report was posted to
+        self.duplicateOf = None  # the first message, if this one repeats it
+
+    @property
+    def rooms(self):
+        """All rooms the message was posted to"""
+        return (self.room,) + self.relayRooms
+
+    @property
+    def upperText(self):
+        """The text in UPPER CASE"""
+        return self.plainText.upper()
 
     def __key(self):
         return (self.room, self.plainText, self.timestamp, self.user)
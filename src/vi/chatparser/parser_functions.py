@@ -20,199 +20,293 @@
 """ 12.02.2015
 	I know this is a little bit dirty, but I prefer to have all the functions
 	to parse the chat in this file together.
-	Wer are now work directly with the html-formatted text, which we use to
-	display it. We are using a HTML/XML-Parser to have the benefit, that we
-	can only work and analyze those text, that is still not on tags, because
-	all the text in tags was allready identified.
-	f.e. the ship_parser:
-		we call it from the chatparser and give them the rtext (richtext).
-		if the parser hits a shipname, it will modifiy the tree by creating
-		a new tag and replace the old text with it (calls tet_replace),
-		than it returns True.
-		The chatparser will call the function again until it return False
-		(None is False) otherwise.
-		We have to call the parser again after a hit, because a hit will change
-		the tree and so the original generator is not longer stable.
+
+	The chat line is split once into tokens, every token is a tuple of
+	(kind, text, payload). URLs and ship names are found on the whole line
+	first, the text between them is split into words which are checked for
+	system names. The remaining plain text is what the status is read from.
+	The html to display is rendered once from the tokens, so we never have to
+	parse html while annotating a line.
 """
 
+import re
+from html import escape
 
 import vi.evegate as evegate
-from bs4 import BeautifulSoup
-from bs4.element import NavigableString
 from vi import states
+from .ahocorasick import AhoCorasick
 
 CHARS_TO_IGNORE = ("*", "?", ",", "!", ".")
 
+# words to ignore on the system parser. use UPPER CASE
+WORDS_TO_IGNORE = ("IN", "IS", "AS")
 
-def textReplace(element, newText):
-    newText = "<t>" + newText + "</t>"
-    newElements = []
-    for newPart in BeautifulSoup(newText, "html.parser").select("t")[0].contents:
-        newElements.append(newPart)
-    for newElement in newElements:
-        element.insert_before(newElement)
-    element.replace_with("")
+# Kinds of the tokens a line is split into
+TEXT = "text"
+SHIP = "ship"
+URL = "url"
+SYSTEM = "system"
 
+URL_PREFIXES = ("http://", "https://")
+WORD_RE = re.compile(r"\S+")
 
-def parseStatus(rtext):
-    texts = [t for t in rtext.contents if isinstance(t, NavigableString)]
-    for text in texts:
-        upperText = text.strip().upper()
-        originalText = upperText
-        for char in CHARS_TO_IGNORE:
-            upperText = upperText.replace(char, "")
-        upperWords = upperText.split()
-        if ("CLEAR" in upperWords or "CLR" in upperWords) and not originalText.endswith(
-            "?"
-        ):
-            return states.CLEAR
-        elif "STAT" in upperWords or "STATUS" in upperWords:
-            return states.REQUEST
-        elif "?" in originalText:
-            return states.REQUEST
-        elif text.strip().upper() in (
-            "BLUE",
-            "BLUES ONLY",
-            "ONLY BLUE" "STILL BLUE",
-            "ALL BLUES",
+SHIP_FORMAT = """<span style="color:#d95911;font-weight:bold"> {0}</span>"""
+URL_FORMAT = """<a href="link/{0}" style="color:#28a5ed;font-weight:bold">{1}</a>"""
+SYSTEM_FORMAT = (
+    """<a href="mark_system/{0}" style="color:#CC8800;font-weight:bold">{1}</a>"""
+)
+
+
+# Keywords the status of a text is read from, use UPPER CASE
+CLEAR_WORDS = frozenset(("CLEAR", "CLR"))
+REQUEST_WORDS = frozenset(("STAT", "STATUS"))
+BLUE_TEXTS = frozenset(("BLUE", "BLUES ONLY", "ONLY BLUE", "STILL BLUE", "ALL BLUES"))
+
+
+def stripIgnoredChars(text):
+    """Returns text without the CHARS_TO_IGNORE. Faster than str.translate for
+    the short texts of chat lines, which mostly contain none of them.
+    """
+    for char in CHARS_TO_IGNORE:
+        if char in text:
+            text = text.replace(char, "")
+    return text
+
+
+def classifyText(text):
+    """Returns the status a plain text tells, None if it tells none"""
+    originalText = text.strip().upper()
+    upperWords = stripIgnoredChars(originalText).split()
+    if not CLEAR_WORDS.isdisjoint(upperWords) and not originalText.endswith("?"):
+        return states.CLEAR
+    elif not REQUEST_WORDS.isdisjoint(upperWords) or "?" in originalText:
+        return states.REQUEST
+    elif originalText in BLUE_TEXTS:
+        return states.CLEAR
+    return None
+
+
+def parseStatus(tokens):
+    """Returns the status of the first text token that tells one"""
+    for kind, text, payload in tokens:
+        if kind == TEXT:
+            status = classifyText(text)
+            if status is not None:
+                return status
+    return None
+
+
+def parseStatuses(tokenLists):
+    """Returns the status of each of the token lists like parseStatus does. The
+    same texts come up again and again in a batch, each one is classified once.
+    """
+    textStatuses = {}
+    statuses = []
+    for tokens in tokenLists:
+        status = None
+        for kind, text, payload in tokens:
+            if kind != TEXT:
+                continue
+            if text not in textStatuses:
+                textStatuses[text] = classifyText(text)
+            status = textStatuses[text]
+            if status is not None:
+                break
+        statuses.append(status)
+    return statuses
+
+
+# All ship names compiled once, so a text is scanned for all ships in one pass
+SHIP_MATCHER = AhoCorasick(evegate.SHIPNAMES)
+
+
+def findShipNames(upperText):
+    """Returns the (start, end) spans of the ship names in upperText, sorted by start.
+    A name counts only if it's preceded by a space or X and followed by a space or
+    S. Longer names win over shorter ones overlapping them.
+    """
+    hits = []
+    lastIdx = len(upperText) - 1
+    for start, end, shipName in SHIP_MATCHER.findAll(upperText):
+        if (start > 0 and upperText[start - 1] not in (" ", "X")) or (
+            end < lastIdx and upperText[end] not in ("S", " ")
         ):
-            return states.CLEAR
+            continue
+        hits.append((start, end))
+    spans = []
+    for start, end in sorted(hits, key=lambda hit: (hit[0] - hit[1], hit[0])):
+        if all(end <= taken[0] or start >= taken[1] for taken in spans):
+            spans.append((start, end))
+    return sorted(spans)
 
 
-def parseShips(rtext):
-    def formatShipName(text, word):
-        newText = """<span style="color:#d95911;font-weight:bold"> {0}</span>"""
-        text = text.replace(word, newText.format(word))
-        return text
+def findUrls(text):
+    """Returns the (start, end) spans of the urls in text, they end at the next space"""
+    # yes, this is faster than regex and less complex to read
+    spans = []
+    pos = 0
+    while True:
+        starts = [text.find(prefix, pos) for prefix in URL_PREFIXES]
+        starts = [start for start in starts if start >= 0]
+        if not starts:
+            return spans
+        start = min(starts)
+        end = text.find(" ", start)
+        if end < 0:
+            end = len(text)
+        spans.append((start, end))
+        pos = end
 
-    texts = [t for t in rtext.contents if isinstance(t, NavigableString)]
-    for text in texts:
-        upperText = text.upper()
-        for shipName in evegate.SHIPNAMES:
-            if shipName in upperText:
-                hit = True
-                start = upperText.find(shipName)
-                end = start + len(shipName)
-                if (start > 0 and upperText[start - 1] not in (" ", "X")) or (
-                    end < len(upperText) - 1 and upperText[end] not in ("S", " ")
-                ):
-                    hit = False
-                if hit:
-                    shipInText = text[start:end]
-                    formatted = formatShipName(text, shipInText)
-                    textReplace(text, formatted)
-                    return True
-
-
-def parseSystems(systems, rtext, foundSystems):
-    systemNames = systems.keys()
-
-    # words to ignore on the system parser. use UPPER CASE
-    WORDS_TO_IGNORE = ("IN", "IS", "AS")
-
-    def formatSystem(text, word, system):
-        newText = """<a style="color:#CC8800;font-weight:bold" href="mark_system/{0}">{1}</a>"""
-        text = text.replace(word, newText.format(system, word))
-        return text
-
-    texts = [t for t in rtext.contents if isinstance(t, NavigableString) and len(t)]
-    for wtIdx, text in enumerate(texts):
-        worktext = text
-        for char in CHARS_TO_IGNORE:
-            worktext = worktext.replace(char, "")
-
-        # Drop redundant whitespace so as to not throw off word index
-        worktext = " ".join(worktext.split())
-        words = worktext.split(" ")
-
-        for idx, word in enumerate(words):
-
-            # Is this about another a system's gate?
-            if len(words) > idx + 1:
-                if words[idx + 1].upper() == "GATE":
-                    bailout = True
-                    if len(words) > idx + 2:
-                        if words[idx + 2].upper() == "TO":
-                            # Could be '___ GATE TO somewhere' so check this one.
-                            bailout = False
-                    if bailout:
-                        # '_____ GATE' mentioned in message, which is not what we're
-                        # interested in, so go to checking next word.
-                        continue
-
-            upperWord = word.upper()
-            if upperWord != word and upperWord in WORDS_TO_IGNORE:
+
+class SystemNameIndex(object):
+    """Resolves a word of a message to a system name in constant time.
+    The rules are the same as walking over all system names in their order, so
+    for every index the first system name wins:
+        exact name, name starts with the word (2-4 chars), word with a dash
+        matches the first letters of both parts (I-I will match I43-IF3),
+        name without dashes starts with the word (F-YH58 named FY)
+    """
+
+    SHORT_PREFIX_LENGTHS = (2, 3, 4)
+
+    def __init__(self, systemNames):
+        self.names = set()
+        self.shortPrefixes = {}
+        self.dashInitials = {}
+        self.dashlessPrefixes = {}
+        for name in systemNames:
+            self.names.add(name)
+            for length in self.SHORT_PREFIX_LENGTHS:
+                if len(name) >= length:
+                    self.shortPrefixes.setdefault(name[:length], name)
+            parts = name.split("-")
+            if len(parts) == 2 and len(parts[0]) > 1 and len(parts[1]) > 1:
+                self.dashInitials.setdefault((parts[0][0], parts[1][0]), name)
+            cleared = name.replace("-", "")
+            for length in range(2, len(cleared) + 1):
+                self.dashlessPrefixes.setdefault(cleared[:length], name)
+
+    def lookup(self, upperWord):
+        """Returns the system name upperWord stands for, None if there is none"""
+        if upperWord in self.names:  # - direct hit on name
+            return upperWord
+        elif 1 < len(upperWord) < 5:  # - upperWord < 4 chars.
+            return self.shortPrefixes.get(upperWord)
+        elif "-" in upperWord and len(upperWord) > 2:  # - short with - (minus)
+            parts = upperWord.split("-")
+            if len(parts) == 2 and len(parts[0]) > 1 and len(parts[1]) > 1:
+                return self.dashInitials.get((parts[0][0], parts[1][0]))
+        elif len(upperWord) > 1:  # what if F-YH58 is named FY?
+            return self.dashlessPrefixes.get(upperWord)
+        return None
+
+
+def systemTokens(text, systems, systemIndex, foundSystems):
+    """Splits a plain text into words and returns the tokens for it, words naming
+    a system become SYSTEM tokens, everything else stays TEXT
+    """
+    words = []
+    for match in WORD_RE.finditer(text):
+        word = stripIgnoredChars(match.group())
+        if word:
+            words.append((match.start(), match.end(), word))
+
+    tokens = []
+    pos = 0
+    for idx, (start, end, word) in enumerate(words):
+        # Is this about another a system's gate?
+        if len(words) > idx + 1 and words[idx + 1][2].upper() == "GATE":
+            # Could be '___ GATE TO somewhere' so check this one.
+            if not (len(words) > idx + 2 and words[idx + 2][2].upper() == "TO"):
+                # '_____ GATE' mentioned in message, which is not what we're
+                # interested in, so go to checking next word.
                 continue
-            if upperWord in systemNames:  # - direct hit on name
-                foundSystems.add(systems[upperWord])  # of the system?
-                formattedText = formatSystem(text, word, upperWord)
-                textReplace(text, formattedText)
-                return True
-            elif 1 < len(upperWord) < 5:  # - upperWord < 4 chars.
-                for system in systemNames:  # system begins with?
-                    if system.startswith(upperWord):
-                        foundSystems.add(systems[system])
-                        formattedText = formatSystem(text, word, system)
-                        textReplace(text, formattedText)
-                        return True
-            elif "-" in upperWord and len(upperWord) > 2:  # - short with - (minus)
-                upperWordParts = upperWord.split("-")  # (I-I will match I43-IF3)
-                for system in systemNames:
-                    systemParts = system.split("-")
-                    if (
-                        len(upperWordParts) == 2
-                        and len(systemParts) == 2
-                        and len(upperWordParts[0]) > 1
-                        and len(upperWordParts[1]) > 1
-                        and len(systemParts[0]) > 1
-                        and len(systemParts[1]) > 1
-                        and len(upperWordParts) == len(systemParts)
-                        and upperWordParts[0][0] == systemParts[0][0]
-                        and upperWordParts[1][0] == systemParts[1][0]
-                    ):
-                        foundSystems.add(systems[system])
-                        formattedText = formatSystem(text, word, system)
-                        textReplace(text, formattedText)
-                        return True
-            elif len(upperWord) > 1:  # what if F-YH58 is named FY?
-                for system in systemNames:
-                    clearedSystem = system.replace("-", "")
-                    if clearedSystem.startswith(upperWord):
-                        foundSystems.add(systems[system])
-                        formattedText = formatSystem(text, word, system)
-                        textReplace(text, formattedText)
-                        return True
-
-    return False
-
-
-def parseUrls(rtext):
-    def findUrls(s):
-        # yes, this is faster than regex and less complex to read
-        urls = []
-        prefixes = ("http://", "https://")
-        for prefix in prefixes:
-            start = 0
-            while start >= 0:
-                start = s.find(prefix, start)
-                if start >= 0:
-                    stop = s.find(" ", start)
-                    if stop < 0:
-                        stop = len(s)
-                    urls.append(s[start:stop])
-                    start += 1
-        return urls
-
-    def formatUrl(text, url):
-        newText = (
-            """<a style="color:#28a5ed;font-weight:bold" href="link/{0}">{0}</a>"""
-        )
-        text = text.replace(url, newText.format(url))
-        return text
-
-    texts = [t for t in rtext.contents if isinstance(t, NavigableString)]
+
+        upperWord = word.upper()
+        if upperWord != word and upperWord in WORDS_TO_IGNORE:
+            continue
+        system = systemIndex.lookup(upperWord)
+        if system is None:
+            continue
+        foundSystems.add(systems[system])
+        wordStart = text.find(word, start, end)
+        if wordStart < 0:
+            # the word was split by an ignored char, nothing we can mark
+            continue
+        if wordStart > pos:
+            tokens.append((TEXT, text[pos:wordStart], None))
+        tokens.append((SYSTEM, word, system))
+        pos = wordStart + len(word)
+    if pos < len(text):
+        tokens.append((TEXT, text[pos:], None))
+    return tokens
+
+
+def tokenizeLine(text, systems, systemIndex, foundSystems):
+    """Splits the text of a chat line into tokens in one pass, for the systems
+    found their value in systems is added to foundSystems
+    """
+    spans = [(start, end, URL) for start, end in findUrls(text)]
+    for start, end in findShipNames(text.upper()):
+        if all(end <= url[0] or start >= url[1] for url in spans):
+            spans.append((start, end, SHIP))
+    spans.sort()
+
+    tokens = []
+    pos = 0
+    for start, end, kind in spans:
+        if start > pos:
+            tokens.extend(
+                systemTokens(text[pos:start], systems, systemIndex, foundSystems)
+            )
+        tokens.append((kind, text[start:end], None))
+        pos = end
+    if pos < len(text):
+        tokens.extend(systemTokens(text[pos:], systems, systemIndex, foundSystems))
+    return tokens
+
+
+def renderTokens(tokens):
+    """Returns the html for the tokens of a line"""
+    parts = ["<rtext>"]
+    for kind, text, payload in tokens:
+        if kind == SHIP:
+            parts.append(SHIP_FORMAT.format(escape(text, False)))
+        elif kind == URL:
+            parts.append(URL_FORMAT.format(escape(text), escape(text, False)))
+        elif kind == SYSTEM:
+            parts.append(SYSTEM_FORMAT.format(payload, escape(text, False)))
+        else:
+            parts.append(escape(text, False))
+    parts.append("</rtext>")
+    return "".join(parts)
+
+
+def annotateTexts(texts, systemIds, systemIndex):
+    """Returns the annotations (html, system ids, status) of the texts, systemIds
+    maps the system names to their ids. The statuses are classified as one batch.
+    """
+    tokenLists = []
+    foundIds = []
     for text in texts:
-        urls = findUrls(text)
-        for url in urls:
-            textReplace(text, formatUrl(text, url))
-            return True
+        found = set()
+        tokenLists.append(tokenizeLine(text, systemIds, systemIndex, found))
+        foundIds.append(tuple(found))
+    return [
+        (renderTokens(tokens), ids, status)
+        for tokens, ids, status in zip(tokenLists, foundIds, parseStatuses(tokenLists))
+    ]
+
+
+# systemIds and the SystemNameIndex of an annotation worker process
+workerSystems = None
+
+
+def initAnnotationWorker(systemIds):
+    """Runs once in every worker process, the index is built there, not pickled"""
+    global workerSystems
+    workerSystems = (systemIds, SystemNameIndex(systemIds.keys()))
+
+
+def annotateInWorker(texts):
+    return annotateTexts(texts, *workerSystems)
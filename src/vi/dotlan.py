@@ -23,6 +23,7 @@
 
 import math
 import datetime
+import collections
 import requests
 import logging
 from bs4 import BeautifulSoup
@@ -624,7 +625,7 @@ class System(object):
         self.secondLine = svgElement.select("text")[1]
         self.lastAlarmTime = 0
         self.lastAlarmTimestamp = 0
-        self.messages = []
+        self.messages = collections.deque()  # the messages inside the intel time
         self.setStatus(states.UNKNOWN)
         self.__locatedCharacters = []
         self.backgroundColor = self.styles.getCommons()["bg_colour"]
@@ -72,9 +72,10 @@ def namesToIds(names, use_outdated=False):
     api_check_names = set()
     cache = Cache()
     # do we have already something in the cache?
-    for name in names:
-        cache_key = "_".join(("id", "name", name))
-        id_from_cache = cache.getFromCache(cache_key, use_outdated)
+    cache_keys = {"_".join(("id", "name", name)): name for name in names}
+    cached = cache.getMany(cache_keys, use_outdated)
+    for cache_key, name in cache_keys.items():
+        id_from_cache = cached.get(cache_key)
         if id_from_cache:
             data[name] = id_from_cache
         else:
@@ -103,9 +104,10 @@ def namesToIds(names, use_outdated=False):
                     data[region["name"]] = region["id"]
 
             # writing the cache
-            for name in data:
-                cache_key = "_".join(("id", "name", name))
-                cache.putIntoCache(cache_key, data[name], 60 * 60 * 24 * 365)
+            cache.putMany(
+                {"_".join(("id", "name", name)): data[name] for name in data},
+                60 * 60 * 24 * 365,
+            )
     except Exception as e:
         logging.error("Exception during namesToIds: %s", e)
     return data
@@ -138,9 +140,10 @@ def idsToNames(ids, use_outdated=False):
     cache = Cache()
 
     # something already in the cache?
-    for checked_id in ids:
-        cache_key = "_".join(("name", "id", str(checked_id)))
-        name = cache.getFromCache(cache_key, use_outdated)
+    cache_keys = {"_".join(("name", "id", str(i))): i for i in ids}
+    cached = cache.getMany(cache_keys, use_outdated)
+    for cache_key, checked_id in cache_keys.items():
+        name = cached.get(cache_key)
         if name:
             data[checked_id] = name
         else:
@@ -162,12 +165,14 @@ def idsToNames(ids, use_outdated=False):
             for elem in content:
                 data[elem["id"]] = elem["name"]
             # and writing into cache
-            for checked_id in api_check_ids:
-                cache_key = "_".join(("name", "id", str(checked_id)))
-                if checked_id in data.keys():
-                    cache.putIntoCache(
-                        cache_key, data[int(checked_id)], 60 * 60 * 24 * 365
-                    )
+            cache.putMany(
+                {
+                    "_".join(("name", "id", str(checked_id))): data[int(checked_id)]
+                    for checked_id in api_check_ids
+                    if checked_id in data.keys()
+                },
+                60 * 60 * 24 * 365,
+            )
     except Exception as e:
         logging.error("Exception during idsToNames: %s", e)
     return data
@@ -382,10 +387,8 @@ def getIncursions(use_outdated=False):
     """builds a list of incursion dicts cached 300s"""
     cache = Cache()
     cache_key = "incursions"
-    result = cache.getFromCache(cache_key, use_outdated)
-    if result:
-        incursion_list = json.loads(result)
-    else:
+    incursion_list = cache.getDecodedFromCache(cache_key, json.loads, use_outdated)
+    if incursion_list is None:
         req = "https://esi.evetech.net/latest/incursions/?datasource=tranquility"
         result = requests.get(req)
         result.raise_for_status()
@@ -407,10 +410,8 @@ def getCampaigns(use_outdated=False):
     """builds a list of reinforced campaigns for IHUB  and TCU dicts cached 60s"""
     cache = Cache()
     cache_key = "campaigns"
-    result = cache.getFromCache(cache_key, use_outdated)
-    if result:
-        campaigns_list = json.loads(result)
-    else:
+    campaigns_list = cache.getDecodedFromCache(cache_key, json.loads, use_outdated)
+    if campaigns_list is None:
         req = "https://esi.evetech.net/latest/sovereignty/campaigns/?datasource=tranquility"
         result = requests.get(req)
         result.raise_for_status()
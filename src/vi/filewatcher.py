@@ -18,8 +18,14 @@
 ###########################################################################
 
 import os
+import sys
 import stat
 import time
+import select
+import threading
+import struct
+import ctypes
+import ctypes.util
 import logging
 
 from PyQt6 import QtCore
@@ -27,6 +33,8 @@ from PyQt6 import QtCore
 # from PyQt6.QtCore import SIGNAL
 from PyQt6.QtCore import pyqtSignal
 
+from vi.chatlogdirectory import ChatLogDirectory, parseLogName
+
 """
 There is a problem with the QFIleWatcher on Windows and the log
 files from EVE.
@@ -37,19 +45,52 @@ reread the files informations, trigger the QFileWatcher.
 So here is a workaround implementation.
 We use here also a QFileWatcher, only to the directory. It will notify it
 if a new file was created. We watch only the newest (last 24h), not all!
+
+On Linux the thread blocks on inotify instead and wakes up as soon as the
+kernel reports a change inside the directory. The polling loop is used
+everywhere else, or if inotify could not be set up.
 """
 
 DEFAULT_MAX_AGE = 60 * 60 * 24
+POLL_INTERVAL = 0.5
+
+# inotify constants, see <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def loadInotify():
+    """Returns the libc with the inotify functions, None if inotify is not available"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libcName = ctypes.util.find_library("c") or "libc.so.6"
+        libc = ctypes.CDLL(libcName, use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+    except (OSError, AttributeError):
+        return None
+    return libc
 
 
 class FileWatcher(QtCore.QThread):
 
     file_change = pyqtSignal(object, object)
 
-    def __init__(self, path, maxAge=DEFAULT_MAX_AGE):
+    def __init__(self, path, maxAge=DEFAULT_MAX_AGE, logDirectory=None):
         QtCore.QThread.__init__(self)
         self.path = path
         self.maxAge = maxAge
+        self.logDirectory = logDirectory or ChatLogDirectory(path)
         self.files = {}
         self.updateWatchedFiles()
         self.qtfw = QtCore.QFileSystemWatcher()
@@ -57,13 +98,36 @@ class FileWatcher(QtCore.QThread):
         self.qtfw.addPath(path)
         self.paused = True
         self.active = True
+        self.inotifyFd = None
+        self.libc = loadInotify()
+        self.wakeupPipe = os.pipe() if self.libc else None
+        self.wakeupLock = threading.Lock()
 
     def directoryChanged(self):
+        self.logDirectory.update()
         self.updateWatchedFiles()
 
     def run(self):
+        try:
+            if self.wakeupPipe and self.setupInotify():
+                logging.info("FileWatcher using inotify on {}".format(self.path))
+                self.runInotify()
+            else:
+                logging.info("FileWatcher polling {}".format(self.path))
+                self.runPolling()
+        finally:
+            self.closeWakeupPipe()
+
+    def closeWakeupPipe(self):
+        with self.wakeupLock:
+            if self.wakeupPipe:
+                os.close(self.wakeupPipe[0])
+                os.close(self.wakeupPipe[1])
+                self.wakeupPipe = None
+
+    def runPolling(self):
         while True:
-            time.sleep(0.5)
+            time.sleep(POLL_INTERVAL)
             if not self.active:
                 return
             if self.paused:
@@ -76,25 +140,121 @@ class FileWatcher(QtCore.QThread):
                     self.file_change.emit(path, True)
                 self.files[path] = pathStat.st_size
 
+    def setupInotify(self):
+        libc = self.libc
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            logging.warning(
+                "inotify_init1 failed: {}".format(os.strerror(ctypes.get_errno()))
+            )
+            return False
+        mask = IN_MODIFY | IN_CREATE | IN_MOVED_TO
+        if libc.inotify_add_watch(fd, os.fsencode(self.path), mask) < 0:
+            logging.warning(
+                "inotify_add_watch failed: {}".format(os.strerror(ctypes.get_errno()))
+            )
+            os.close(fd)
+            return False
+        self.inotifyFd = fd
+        return True
+
+    def readInotifyEvents(self):
+        """Reads all pending events and returns the set of changed paths, a burst
+        of events for the same file is reported only once
+        """
+        changed = set()
+        while True:
+            try:
+                buffer = os.read(self.inotifyFd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(buffer, offset)
+                offset += INOTIFY_EVENT.size
+                name = buffer[offset : offset + length].rstrip(b"\0")
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    # the kernel dropped events, so check all files we know
+                    changed.update(self.files.keys())
+                elif name and parseLogName(os.fsdecode(name)) is not None:
+                    # like the polling loop, only chat logs are reported
+                    changed.add(os.path.join(self.path, os.fsdecode(name)))
+        return changed
+
+    def runInotify(self):
+        pending = set()
+        try:
+            while self.active:
+                # while paused we have to look again for the flag, else just block
+                timeout = POLL_INTERVAL if pending else None
+                readable, _, _ = select.select(
+                    [self.inotifyFd, self.wakeupPipe[0]], [], [], timeout
+                )
+                if not self.active:
+                    return
+                if self.inotifyFd in readable:
+                    pending.update(self.readInotifyEvents())
+                if self.paused:
+                    continue
+                for path in pending:
+                    try:
+                        pathStat = os.stat(path)
+                    except OSError:
+                        continue
+                    if not stat.S_ISREG(pathStat.st_mode):
+                        continue
+                    self.files[path] = pathStat.st_size
+                    self.file_change.emit(path, True)
+                pending = set()
+        finally:
+            os.close(self.inotifyFd)
+            self.inotifyFd = None
+
     def quit(self):
         self.active = False
+        with self.wakeupLock:
+            if self.wakeupPipe:
+                os.write(self.wakeupPipe[1], b"\0")
+        if not self.isRunning():
+            # the thread never ran, so nobody else closes the pipe
+            self.closeWakeupPipe()
         QtCore.QThread.quit(self)
 
     def updateWatchedFiles(self):
-        # Reading all files from the directory
-        fullPath = None
-        now = time.time()
-        path = self.path
-        filesInDir = {}
-        for f in os.listdir(path):
-            try:
-                fullPath = os.path.join(path, f)
-                pathStat = os.stat(fullPath)
-                if not stat.S_ISREG(pathStat.st_mode):
-                    continue
-                if self.maxAge and ((now - pathStat.st_mtime) > self.maxAge):
-                    continue
-                filesInDir[fullPath] = self.files.get(fullPath, 0)
-            except:
-                pass
-        self.files = filesInDir
+        # Only the logs of the last maxAge seconds, the index knows which to stat
+        maxAge = self.maxAge or float("inf")
+        self.files = {
+            path: self.files.get(path, 0)
+            for path in self.logDirectory.recentLogs(maxAge)
+        }
+
+
+class FileChangeCoalescer(QtCore.QObject):
+    """Collects the paths of changed files for a short window and hands them on
+    as one batch, so a burst of writes is parsed only once
+    """
+
+    files_changed = pyqtSignal(list)
+
+    def __init__(self, windowMsecs, parent=None):
+        QtCore.QObject.__init__(self, parent)
+        self.dirtyPaths = []
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(windowMsecs)
+        self.timer.timeout.connect(self.flush)
+
+    def fileChanged(self, path, modified=True):
+        if path not in self.dirtyPaths:
+            self.dirtyPaths.append(path)
+        # the window starts with the first change, later ones do not extend it
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def flush(self):
+        self.timer.stop()
+        paths = self.dirtyPaths
+        self.dirtyPaths = []
+        if paths:
+            self.files_changed.emit(paths)
@@ -17,15 +17,18 @@
 #  along with this program.	 If not, see <http://www.gnu.org/licenses/>.  #
 ###########################################################################
 
+import os
 import time
 import logging
 import queue
 from PyQt6.QtCore import QThread, QTimer, pyqtSignal
 from vi import evegate
 from vi.cache.cache import Cache
+from vi.chatparser.chatparser import ChatParser
 from vi.resources import resourcePath
 
 STATISTICS_UPDATE_INTERVAL_MSECS = 1 * 60 * 1000
+CHECKPOINT_SAVE_INTERVAL_SECS = 60
 
 
 class AvatarFindThread(QThread):
@@ -136,3 +139,100 @@ class MapStatisticsThread(QThread):
         self.active = False
         self.queue.put(None)
         QThread.quit(self)
+
+
+class ChatParserThread(QThread):
+    """Owns the ChatParser and turns changed logs into messages off the GUI thread.
+    Requests are handled in the order they were made, each batch of messages is
+    sent back with messages_parsed.
+    """
+
+    messages_parsed = pyqtSignal(list, bool)
+    read_failed = pyqtSignal(str, str)
+
+    def __init__(self, path, rooms, intelTime, logDirectory=None):
+        QThread.__init__(self)
+        self.queue = queue.Queue()
+        self.active = True
+        self.path = path
+        self.logDirectory = logDirectory
+        self.rooms = rooms
+        self.intelTime = intelTime
+        self.chatparser = None
+        self.lastCheckpointSave = time.time()
+
+    def setupParser(self, systems):
+        """Replaces the parser with a new one for the given systems"""
+        self.queue.put((self._setupParser, (systems,)))
+
+    def parseFiles(self, paths, rescan=False):
+        self.queue.put((self._parseFiles, (paths, rescan)))
+
+    def setRooms(self, rooms):
+        self.queue.put((self._setRooms, (rooms,)))
+
+    def setIntelTime(self, intelTime):
+        self.queue.put((self._setIntelTime, (intelTime,)))
+
+    def _setupParser(self, systems):
+        if self.chatparser:
+            self.chatparser.close()
+        self.chatparser = ChatParser(
+            self.path,
+            self.rooms,
+            systems,
+            self.intelTime,
+            self.read_failed.emit,
+            self.logDirectory,
+        )
+        # the intel of the logs inside the intel time, read when the parser started
+        messages = self.chatparser.initialMessages
+        self.chatparser.initialMessages = []
+        if messages:
+            self.messages_parsed.emit(messages, True)
+
+    def _parseFiles(self, paths, rescan):
+        if not self.chatparser:
+            return
+        if rescan:
+            # read in parallel and merged in timestamp order by the parser
+            messages = self.chatparser.rescanFiles(paths)
+        else:
+            messages = []
+            for path in paths:
+                try:
+                    messages.extend(self.chatparser.fileModified(path))
+                except Exception as e:
+                    logging.error("Error in ChatParserThread parsing %s: %s", path, e)
+        self.messages_parsed.emit(messages, rescan)
+        if time.time() - self.lastCheckpointSave > CHECKPOINT_SAVE_INTERVAL_SECS:
+            self.chatparser.saveCheckpoints()
+            self.lastCheckpointSave = time.time()
+
+    def _setRooms(self, rooms):
+        self.rooms = rooms
+        if self.chatparser:
+            self.chatparser.rooms = rooms
+
+    def _setIntelTime(self, intelTime):
+        self.intelTime = intelTime
+        if self.chatparser:
+            self.chatparser.intelTime = intelTime
+
+    def run(self):
+        while True:
+            request = self.queue.get()
+            if not self.active:
+                if self.chatparser:
+                    self.chatparser.close()
+                return
+            function, args = request
+            try:
+                function(*args)
+            except Exception as e:
+                logging.error("Error in ChatParserThread: %s", e)
+
+    def quit(self):
+        self.active = False
+        self.queue.put(None)
+        QThread.quit(self)
@@ -38,15 +38,17 @@ from vi import states
 from vi.cache.cache import Cache
 from vi.resources import resourcePath, resourcePathExists
 from vi.soundmanager import SoundManager
-from vi.threads import AvatarFindThread, MapStatisticsThread
+from vi.threads import AvatarFindThread, MapStatisticsThread, ChatParserThread
 from vi.ui.systemtray import TrayContextMenu
 from vi.ui.styles import Styles
-from vi.chatparser.chatparser import ChatParser, Message
+from vi.chatparser.chatparser import Message
+from vi.chatlogdirectory import ChatLogDirectory
 from PyQt6.QtGui import QAction, QActionGroup
 
 
 # Timer intervals
 MAP_UPDATE_INTERVAL_MSECS = 1000
+FILE_CHANGE_COALESCE_MSECS = 30
 CLIPBOARD_CHECK_INTERVAL_MSECS = 4 * 1000
 
 DEFAULT_ROOM_MANES = ["Scald Intel", "FI.RE Intel"]
@@ -175,10 +177,6 @@ class MainWindow(QtWidgets.QMainWindow):
             self.menuTheme.addAction(action)
         styles = None
 
-        update_splash_window_info("Setting up ChatParser")
-        self.chatparser = ChatParser(
-            self.pathToLogs, self.roomnames, None, self.intelTimeGroup.intelTime
-        )
         self.wireUpUIConnections()
         self.recallCachedSettings()
         self.setupThreads()
@@ -333,8 +331,27 @@ class MainWindow(QtWidgets.QMainWindow):
         self.avatarFindThread.avatar_update.connect(self.updateAvatarOnChatEntry)
         self.avatarFindThread.start()
 
-        self.filewatcherThread = filewatcher.FileWatcher(self.pathToLogs)
-        self.filewatcherThread.file_change.connect(self.logFileChanged)
+        self.chatLogDirectory = ChatLogDirectory(self.pathToLogs)
+        self.chatParserThread = ChatParserThread(
+            self.pathToLogs,
+            self.roomnames,
+            self.intelTimeGroup.intelTime,
+            self.chatLogDirectory,
+        )
+        self.chatParserThread.messages_parsed.connect(self.chatMessagesParsed)
+        self.chatParserThread.read_failed.connect(self.showLogReadError)
+        self.chatParserThread.start()
+
+        self.fileChangeCoalescer = filewatcher.FileChangeCoalescer(
+            FILE_CHANGE_COALESCE_MSECS, self
+        )
+        self.fileChangeCoalescer.files_changed.connect(self.logFilesChanged)
+        self.filewatcherThread = filewatcher.FileWatcher(
+            self.pathToLogs, logDirectory=self.chatLogDirectory
+        )
+        self.filewatcherThread.file_change.connect(
+            self.fileChangeCoalescer.fileChanged
+        )
         self.filewatcherThread.start()
 
         self.statisticsThread = MapStatisticsThread()
@@ -350,9 +367,19 @@ class MainWindow(QtWidgets.QMainWindow):
             self.avatarFindThread.wait()
             self.filewatcherThread.quit()
             self.filewatcherThread.wait()
+            self.fileChangeCoalescer.timer.stop()
+            self.chatParserThread.quit()
+            self.chatParserThread.wait()
             self.statisticsThread.quit()
             self.statisticsThread.wait()
             self.mapTimer.stop()
+            # the threads are done writing, commit what is still queued
+            Cache.flushWrites()
+            logging.info(
+                "Front cache: {} hits, {} misses, hit rate {:.1%}".format(
+                    Cache.FRONT.hits, Cache.FRONT.misses, Cache.FRONT.hitRate
+                )
+            )
         except Exception as ex:
             logging.critical(ex)
             pass
@@ -474,10 +501,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.setJumpbridges(Cache().getFromCache("jumpbridge_url"))
         self.systems = self.dotlan.systems
         logging.debug("Creating chat parser")
-        self.chatparser.systems = self.systems
-        self.chatparser = ChatParser(
-            self.pathToLogs, self.roomnames, self.systems, self.intelTimeGroup.intelTime
-        )
+        self.chatParserThread.setupParser(self.systems)
 
         # Update the new map view, then clear old statistics from the map and request new
         logging.debug("Updating the map")
@@ -492,24 +516,17 @@ class MainWindow(QtWidgets.QMainWindow):
         logging.info("Intel ReScan begun")
         self.clearIntelChat()
 
-        now = datetime.datetime.now()
-        for file in os.listdir(self.pathToLogs):
-            if file.endswith(".txt"):
-                filePath = self.pathToLogs + str(os.sep) + file
-                roomname = file[:-31]
-
-                mtime = datetime.datetime.fromtimestamp(os.path.getmtime(filePath))
-                delta = now - mtime
-                if (
-                    delta.total_seconds() < (60 * self.chatparser.intelTime)
-                    and delta.total_seconds() > 0
-                ):
-                    if roomname in self.roomnames:
-                        logging.info("Reading log {}".format(roomname))
-                        self.logFileChanged(filePath, rescan=True)
-                        # self.logFileChanged(filePath, rescan=True)
-        logging.info("Intel ReScan done")
-        self.updateMapView()
+        self.chatLogDirectory.update()
+        rescanPaths = self.chatLogDirectory.recentLogs(
+            60 * self.intelTimeGroup.intelTime, self.roomnames
+        )
+        for filePath in rescanPaths:
+            logging.info(
+                "Reading log {}".format(self.chatLogDirectory.roomName(filePath))
+            )
+        # the map is updated when the parser thread sends the messages back
+        self.chatParserThread.parseFiles(rescanPaths, rescan=True)
+        logging.info("Intel ReScan requested")
 
     def startClipboardTimer(self):
         """
@@ -616,9 +633,9 @@ class MainWindow(QtWidgets.QMainWindow):
     def changeIntelTime(self):
         action = self.intelTimeGroup.checkedAction()
         self.intelTimeGroup.intelTime = action.intelTime
-        self.chatparser.intelTime = action.intelTime
+        self.chatParserThread.setIntelTime(action.intelTime)
         self.timeInfo.setText(
-            "All Intel( past{} minutes)".format(self.chatparser.intelTime)
+            "All Intel( past{} minutes)".format(self.intelTimeGroup.intelTime)
         )
         self.rescanIntel()
 
@@ -912,6 +929,11 @@ class MainWindow(QtWidgets.QMainWindow):
         if scrollToBottom:
             self.chatListWidget.scrollToBottom()
 
+    def updateIntelChatRooms(self, message):
+        for entry in self.chatEntries:
+            if entry.message is message:
+                entry.updateText()
+
     def clearIntelChat(self):
         logging.info("Clearing Intel")
         self.setupMap()
@@ -937,7 +959,7 @@ class MainWindow(QtWidgets.QMainWindow):
                 chatEntryWidget = self.chatListWidget.itemWidget(chatListWidgetItem)
                 message = chatEntryWidget.message
                 if now - time.mktime(message.timestamp.timetuple()) > (
-                    60 * self.chatparser.intelTime
+                    60 * self.intelTimeGroup.intelTime
                 ):
                     self.chatEntries.remove(chatEntryWidget)
                     self.chatListWidget.takeItem(0)
@@ -953,7 +975,8 @@ class MainWindow(QtWidgets.QMainWindow):
         Cache().putIntoCache(
             "room_names", ",".join(newRoomnames), 60 * 60 * 24 * 365 * 5
         )
-        self.chatparser.rooms = newRoomnames
+        self.roomnames = newRoomnames
+        self.chatParserThread.setRooms(newRoomnames)
 
     def showInfo(self):
         infoDialog = QtWidgets.QDialog(self)
@@ -1011,10 +1034,38 @@ class MainWindow(QtWidgets.QMainWindow):
     def zoomMapOut(self):
         self.mapView.zoomOut()
 
-    def logFileChanged(self, path, rescan=False):
+    def logFilesChanged(self, paths):
+        """Hands a batch of changed logs to the parser thread"""
+        self.chatParserThread.parseFiles(paths)
+
+    def showLogReadError(self, path, error):
+        QMessageBox.warning(
+            None,
+            "Read a log file failed!",
+            "File: {0} - problem: {1}".format(path, error),
+            QMessageBox.StandardButton.Ok,
+        )
+
+    def chatMessagesParsed(self, messages, rescan):
+        """Applies a batch of messages from the parser thread, the chat list and map
+        are refreshed once per batch
+        """
+        self.chatListWidget.setUpdatesEnabled(False)
+        try:
+            self.applyMessages(messages)
+        finally:
+            self.chatListWidget.setUpdatesEnabled(True)
+        if rescan:
+            logging.info("Intel ReScan done")
+        self.updateMapView()
+
+    def applyMessages(self, messages):
         locale_to_set = dict()
-        messages = self.chatparser.fileModified(path, rescan)
         for message in messages:
+            # A repost of an earlier report only adds its room to the first one
+            if message.duplicateOf is not None:
+                self.updateIntelChatRooms(message.duplicateOf)
+                continue
             # If players location has changed
             if message.status == states.LOCATION:
                 locale_to_set[message.user] = message.systems[0]
@@ -1035,16 +1086,15 @@ class MainWindow(QtWidgets.QMainWindow):
                 self.addMessageToIntelChat(message)
                 # For each system that was mentioned in the message, check for alarm distance to the current system
                 # and alarm if within alarm distance.
-                systemList = self.dotlan.systems
+                systemsById = self.dotlan.systemsById
                 if message.systems:
-                    for system in message.systems:
-                        system_name = system.name
-                        if system_name in systemList.keys():
-                            systemList[system_name].setStatus(
-                                message.status, message.timestamp
-                            )
+                    for systemId in message.systems:
+                        system = systemsById.get(systemId)
+                        if system is not None:
+                            system.setStatus(message.status, message.timestamp)
                         else:
-                            return
+                            # parsed against a map that was replaced meanwhile
+                            continue
                         if (
                             message.status in (states.ALARM)
                             and message.user not in self.knownPlayerNames
@@ -1071,8 +1121,6 @@ class MainWindow(QtWidgets.QMainWindow):
         for name, sys in locale_to_set.items():
             self.knownPlayerNames.add(name)
             self.setLocation(name, sys)
-        if not rescan:
-            self.updateMapView()
 
     def systemUnderMouse(self, pos: QPoint):
         """returns the name of the system under the mouse pointer"""
@@ -1245,7 +1293,7 @@ class SystemChat(QtWidgets.QDialog):
         if self.chatType == SystemChat.SYSTEM:
             message = entry.message
             avatarPixmap = entry.avatarLabel.pixmap()
-            if self.selector in message.systems:
+            if self.selector.systemId in message.systems:
                 self._addMessageToChat(message, avatarPixmap)
 
     def openDotlan(self):
@@ -1314,7 +1362,7 @@ class ChatEntryWidget(QtWidgets.QWidget):
         time = datetime.datetime.strftime(self.message.timestamp, "%H:%M:%S")
         text = "<small>{time} - <b>{user}</b> - <i>{room}</i></small><br>{text}".format(
             user=self.message.user,
-            room=self.message.room,
+            room=", ".join(self.message.rooms),
             time=time,
             text=self.message.message.rstrip(" \r\n").lstrip(" \r\n"),
         )